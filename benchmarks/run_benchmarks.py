@@ -0,0 +1,228 @@
+'''
+Copyright (c) Facebook, Inc. and its affiliates.
+All rights reserved.
+This source code is licensed under the license found in the
+LICENSE file in the root directory of this source tree.
+'''
+
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+#make the dataset creation scripts importable when run as benchmarks/run_benchmarks.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_parsing
+import split_data
+import utils
+from benchmarks.synthetic_dump import generate_dump
+
+'''
+This script benchmarks the dataset creation pipeline on a synthetic Wiktionary
+dump and writes the throughput and peak memory of each stage to a json file.
+'''
+
+parser = argparse.ArgumentParser(description='FEWS Pipeline Benchmarks')
+parser.add_argument('--pages', type=int, default=5000,
+	help='Number of pages in the synthetic dump')
+parser.add_argument('--seed', type=int, default=0,
+	help='Random seed for the synthetic dump')
+parser.add_argument('--repeat', type=int, default=3,
+	help='Number of timed runs per benchmark (the fastest is reported)')
+parser.add_argument('--output', type=str, default='bench_results.json',
+	help='Filepath at which to save the benchmark results')
+parser.add_argument('--compare', type=str, default=None,
+	help='Filepath of earlier benchmark results to compare against')
+parser.add_argument('--no-memory', action='store_true',
+	help='Skip the (slower) peak memory measurement of each benchmark')
+parser.add_argument('--work-dir', type=str, default=None,
+	help='Directory for the synthetic dump and output files (defaults to a temporary directory)')
+
+#times func(*setup()) over repeated runs, keeping the fastest, then measures the
+#peak memory allocated by one more run with tracemalloc
+def run_benchmark(name, setup, func, items, unit, nbytes, repeat, memory):
+	best = None
+	for _ in range(repeat):
+		args = setup()
+		start = time.perf_counter()
+		func(*args)
+		elapsed = time.perf_counter()-start
+		if best is None or elapsed < best: best = elapsed
+
+	result = {'seconds': best,
+		'items': items,
+		'unit': unit,
+		'items_per_s': items/best if best > 0 else None,
+		'mb': nbytes/2**20,
+		'mb_per_s': nbytes/2**20/best if best > 0 else None}
+
+	if memory:
+		args = setup()
+		tracemalloc.start()
+		func(*args)
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		result['peak_mb'] = peak/2**20
+
+	print('{:<24} {:>10.3f}s {:>12.1f} {}/s {:>8.2f} MB/s'.format(name, best, result['items_per_s'] or 0,
+		unit, result['mb_per_s'] or 0)+('  peak {:.1f} MB'.format(result['peak_mb']) if memory else ''))
+	return result
+
+#splits the lines of a page into the line lists of its senses, as process_pos does
+def sense_blocks(page):
+	blocks = []
+	for line in page:
+		if re.match(r'^#* ', line): blocks.append([line])
+		elif len(blocks) > 0: blocks[-1].append(line)
+	return blocks
+
+#gets the short commit hash of the checked out code, if it is in a git repo
+def git_commit():
+	try:
+		out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+			cwd=os.path.dirname(os.path.abspath(__file__)))
+		if out.returncode == 0: return out.stdout.strip()
+	except OSError:
+		pass
+	return None
+
+#prints the speedup of each benchmark over earlier results
+def compare_results(results, filepath):
+	with open(filepath, 'r') as f:
+		old = json.load(f)
+	print('\ncompared to {} ({}):'.format(filepath, old['meta'].get('commit')))
+	for name, r in results['benchmarks'].items():
+		if name not in old['benchmarks']: continue
+		o = old['benchmarks'][name]
+		line = '{:<24} {:>6.2f}x time'.format(name, o['seconds']/r['seconds'])
+		if 'peak_mb' in r and 'peak_mb' in o and r['peak_mb'] > 0:
+			line += ' {:>6.2f}x memory'.format(o['peak_mb']/r['peak_mb'])
+		print(line)
+
+def main(args):
+	work_dir = args.work_dir
+	if work_dir is None:
+		tmp = tempfile.TemporaryDirectory()
+		work_dir = tmp.name
+	if not os.path.exists(work_dir):
+		os.makedirs(work_dir)
+	memory = not args.no_memory
+	repeat = args.repeat
+
+	#generate synthetic dump
+	dump_path = os.path.join(work_dir, 'dump.xml')
+	generate_dump(dump_path, args.pages, args.seed)
+	dump_bytes = os.path.getsize(dump_path)
+
+	benchmarks = {}
+	def bench(name, setup, func, items, unit, nbytes):
+		benchmarks[name] = run_benchmark(name, setup, func, items, unit, nbytes, repeat, memory)
+
+	#reading and splitting the dump into pages
+	pages = list(data_parsing.read_pages(data_parsing.read_dump(dump_path)))
+	bench('read_pages', lambda: (), lambda: list(data_parsing.read_pages(data_parsing.read_dump(dump_path))),
+		len(pages), 'pages', dump_bytes)
+	bench('read_pages_mmap', lambda: (), lambda: list(data_parsing.read_pages_mmap(dump_path)),
+		len(pages), 'pages', dump_bytes)
+
+	#parsing pages
+	page_bytes = sum(len(line) for p in pages for line in p)
+	bench('process_page', lambda: (pages,), lambda pages: [data_parsing.process_page(p) for p in pages],
+		len(pages), 'pages', page_bytes)
+
+	#compressing the lines of each sense
+	blocks = [b[1:] for p in pages for b in sense_blocks(p)]
+	block_bytes = sum(len(line) for b in blocks for line in b)
+	bench('compress_lines', lambda: (blocks,), lambda blocks: [data_parsing.compress_lines(b) for b in blocks],
+		len(blocks), 'senses', block_bytes)
+
+	#cleaning glosses, and quotes/examples with mention matching
+	parsed = []
+	for p in pages:
+		s = data_parsing.process_page(p)
+		if s != -1: parsed.extend(s)
+	def clear_caches():
+		if hasattr(data_parsing, 'is_mention'): data_parsing.is_mention.cache_clear()
+		return ()
+	glosses = [b[0].strip('#').strip() for p in pages for b in sense_blocks(p)]
+	bench('clean_text', clear_caches, lambda: [data_parsing.clean_text(g) for g in glosses],
+		len(glosses), 'texts', sum(len(g) for g in glosses))
+	mentions = []
+	for s in parsed:
+		s_id = data_parsing.generate_word_key(s)+'.0'
+		mentions.extend((q, s_id) for q, _ in s['quotations'])
+		mentions.extend((e, s_id) for e in s['examples'])
+	bench('clean_text_mentions', clear_caches, lambda: [data_parsing.clean_text(x, match_sense=s_id) for x, s_id in mentions],
+		len(mentions), 'texts', sum(len(x) for x, _ in mentions))
+
+	#post-processing senses into senses, quotations and examples
+	parsed_bytes = len(repr(parsed))
+	bench('post_processing', lambda: (copy.deepcopy(parsed),), data_parsing.post_processing,
+		len(parsed), 'senses', parsed_bytes)
+	senses, quotations, examples = data_parsing.post_processing(copy.deepcopy(parsed))
+
+	#saving and loading the dataset files
+	s_path = os.path.join(work_dir, 'senses.txt')
+	q_path = os.path.join(work_dir, 'quotations.txt')
+	e_path = os.path.join(work_dir, 'examples.txt')
+	utils.save_senses(s_path, senses)
+	utils.save_quotations(q_path, quotations)
+	utils.save_examples(e_path, examples)
+	s_bytes = os.path.getsize(s_path)
+	q_bytes = os.path.getsize(q_path)
+	e_bytes = os.path.getsize(e_path)
+	bench('save_senses', lambda: (s_path, senses), utils.save_senses, len(senses), 'senses', s_bytes)
+	bench('save_quotations', lambda: (q_path, quotations), utils.save_quotations, len(quotations), 'rows', q_bytes)
+	bench('save_examples', lambda: (e_path, examples), utils.save_examples, len(examples), 'rows', e_bytes)
+	bench('load_senses', lambda: (s_path,), utils.load_senses, len(senses), 'senses', s_bytes)
+	bench('load_quotations', lambda: (q_path,), utils.load_quotations, len(quotations), 'rows', q_bytes)
+	bench('load_examples', lambda: (e_path,), utils.load_examples, len(examples), 'rows', e_bytes)
+
+	#splitting quotations into train/dev/test
+	loaded_senses = utils.load_senses(s_path)
+	loaded_quotes = utils.load_quotations(q_path)
+	loaded_examples = utils.load_examples(e_path)
+	bench('build_sense_index', lambda: (loaded_senses, loaded_quotes, loaded_examples), utils.build_sense_index,
+		len(loaded_senses), 'senses', s_bytes)
+	sense_index = utils.build_sense_index(loaded_senses, loaded_quotes, loaded_examples)
+	def split(quotes, senses):
+		with contextlib.redirect_stdout(io.StringIO()):
+			data, _ = split_data.filter_monosemous_data(quotes, sense_index)
+			split_data.split_data(data, senses, sense_index)
+	bench('split_data', lambda: (list(loaded_quotes), loaded_senses), split,
+		len(loaded_quotes), 'rows', q_bytes)
+
+	results = {'meta': {'commit': git_commit(),
+			'python': platform.python_version(),
+			'pages': args.pages,
+			'seed': args.seed,
+			'repeat': repeat,
+			'dump_mb': dump_bytes/2**20,
+			'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/2**10},
+		'benchmarks': benchmarks}
+	with open(args.output, 'w') as f:
+		json.dump(results, f, indent=1, sort_keys=True)
+		f.write('\n')
+
+	if args.compare is not None:
+		compare_results(results, args.compare)
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	main(args)
+
+#EOF
@@ -0,0 +1,199 @@
+'''
+Copyright (c) Facebook, Inc. and its affiliates.
+All rights reserved.
+This source code is licensed under the license found in the
+LICENSE file in the root directory of this source tree.
+'''
+
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import random
+
+'''
+This script generates a synthetic Wiktionary dump file with the same structure
+as the real one, for measuring the parser without the multi-GB dump.
+'''
+
+parser = argparse.ArgumentParser(description='Synthetic Wiktionary Dump Generator')
+parser.add_argument('--out-file', type=str, required=True,
+	help='Filepath at which to save the generated dump')
+parser.add_argument('--pages', type=int, default=10000,
+	help='Number of pages in the generated dump')
+parser.add_argument('--seed', type=int, default=0,
+	help='Random seed; the same seed always generates the same dump')
+
+WORDS = ['run', 'bank', 'set', 'light', 'word', 'play', 'take', 'fair', 'bark', 'spring', 'match', 'rock',
+	'pitch', 'ring', 'seal', 'bat', 'bear', 'fall', 'lead', 'left', 'mine', 'nail', 'park', 'row', 'saw',
+	'New York', 'ice cream', 'a', 'go', 'dog', 'cat', 'tree', 'house', 'water', 'stone']
+FILLER = ('the of and to in is was he she it that for on with as at by from his her they we you this '
+	'had not are but or have an be which one all were there their would what so when can said who '
+	'very many some time only could into them then more these long about little day great old man').split()
+LANGUAGES = ['English', 'French', 'German', 'Spanish', 'Translingual', 'Latin', 'Italian']
+HEADERS = ['Noun', 'Verb', 'Adjective', 'Adverb', 'Proper noun', 'Pronoun', 'Etymology', 'Pronunciation', 'Interjection']
+TAGS = ['obsolete', 'rare', 'archaic', 'slang', 'transitive', 'intransitive', 'informal', 'dated', 'UK', 'US']
+NAMESPACES = ['Wiktionary', 'Template', 'Category', 'Appendix', 'Thesaurus', 'Index', 'Rhymes']
+MARKUP = ['&amp;nbsp;', '&amp;hellip;', '’', '&amp;mdash;', '{{...}}', '&lt;sup&gt;2&lt;/sup&gt;',
+	'&lt;br&gt;', '&amp;ldquo;', '\\pi', '&lt;math&gt;x&lt;/math&gt;']
+
+#generates a sentence, with a bolded (possibly inflected) mention of word if mark is set
+def generate_sentence(r, word, mark=True):
+	n = r.randint(3, 25)
+	toks = [r.choice(FILLER) for _ in range(n)]
+	if mark:
+		form = r.choice([word, word+'s', word+'ing', word+'ed', word.upper(), word[:1], 'xyz'])
+		toks[r.randrange(n)] = '\'\'\''+form+'\'\'\''
+	if r.random() < 0.2:
+		toks.insert(r.randrange(len(toks)), '[['+r.choice(FILLER)+']]')
+	if r.random() < 0.2:
+		toks.insert(r.randrange(len(toks)), '[[w:'+r.choice(FILLER)+'|'+r.choice(FILLER)+']]')
+	if r.random() < 0.1:
+		toks.insert(r.randrange(len(toks)), '\'\''+r.choice(FILLER)+'\'\'')
+	if r.random() < 0.1:
+		toks.insert(r.randrange(len(toks)), '&amp;quot;'+r.choice(FILLER)+'&amp;quot;')
+	if r.random() < 0.1:
+		toks.insert(r.randrange(len(toks)), '{{w|'+r.choice(FILLER)+'}}')
+	if r.random() < 0.1:
+		toks.insert(r.randrange(len(toks)), r.choice(MARKUP))
+	sent = ' '.join(toks)
+	return sent[0].upper()+sent[1:]+r.choice(['.', '!', '?', ''])
+
+#generates the gloss of a sense, with tags and wiki markup
+def generate_gloss(r):
+	gloss = ' '.join(r.choice(FILLER) for _ in range(r.randint(0, 12)))
+	if r.random() < 0.4:
+		gloss = '{{lb|en|'+'|'.join(r.sample(TAGS, r.randint(1, 3)))+'}} '+gloss
+	if r.random() < 0.3:
+		gloss += ' [['+r.choice(FILLER)+']]'
+	if r.random() < 0.3:
+		gloss += ' [['+r.choice(FILLER)+'|'+r.choice(FILLER)+']]'
+	if r.random() < 0.1:
+		gloss += ' &lt;!-- comment --&gt;'
+	if r.random() < 0.1:
+		gloss += ' {{gloss|'+r.choice(FILLER)+'}}'
+	if r.random() < 0.05:
+		gloss += ' [[Category:'+r.choice(FILLER)+']] [[File:'+r.choice(FILLER)+'.jpg|thumb]]'
+	return gloss
+
+#generates the lines of a quotation in one of the formats used on Wiktionary
+def generate_quotation(r, word, depth):
+	h = '#'*depth
+	k = r.random()
+	year = str(r.randint(1500, 2020))
+	if k < 0.3: #attribution line followed by (multi-line) #*: quote
+		lines = [h+'* \'\'\''+year+'\'\'\', Author Name, \'\'Some Book\'\', page '+str(r.randint(1, 300))+':',
+			h+'*: '+generate_sentence(r, word)]
+		if r.random() < 0.2: lines.append(h+'*: '+generate_sentence(r, word))
+		return lines
+	elif k < 0.55:
+		return [h+'* {{quote-book|en|year='+year+'|author=Someone|title=A Book|passage='+generate_sentence(r, word)+'}}']
+	elif k < 0.65:
+		return [h+'* {{quote-journal|en|year='+year+'|title=Journal|'+generate_sentence(r, word)+'}}']
+	elif k < 0.75:
+		return [h+'* '+generate_sentence(r, word)+' &lt;ref&gt;Author, '+year+'&lt;/ref&gt;']
+	elif k < 0.85:
+		return [h+'* \'\''+year+'\'\' Someone: &quot;'+generate_sentence(r, word)+'&quot;']
+	elif k < 0.9:
+		return [h+'* '+generate_sentence(r, word)]
+	elif k < 0.93:
+		return [h+'* {{seemoreCites}}']
+	elif k < 0.96: #quote wrapped onto a line without a leading #
+		return [h+'* \'\'\''+year+'\'\'\', Someone,', h+'*: '+generate_sentence(r, word),
+			'continued '+generate_sentence(r, word, mark=False)]
+	else:
+		return [h+'* {{quote-book|en|year='+year+'|author=Someone}}', h+'*: '+generate_sentence(r, word)]
+
+#generates the lines of a sense, with examples, synonyms, quotations and nested senses
+def generate_sense(r, word, depth):
+	h = '#'*depth
+	lines = [h+' '+generate_gloss(r)]
+	for _ in range(r.randint(0, 4)):
+		k = r.random()
+		if k < 0.3:
+			lines.append(h+': {{ux|en|'+generate_sentence(r, word)+'}}')
+		elif k < 0.4:
+			syns = [r.choice(FILLER) for _ in range(r.randint(1, 3))]
+			if r.random() < 0.3: syns.append('Thesaurus:'+word)
+			lines.append(h+': {{syn|en|'+'|'.join(syns)+'}}')
+		elif k < 0.45:
+			lines.append(h+': '+generate_sentence(r, word))
+		else:
+			lines.extend(generate_quotation(r, word, depth))
+	if depth == 1 and r.random() < 0.3:
+		for _ in range(r.randint(1, 3)):
+			lines.extend(generate_sense(r, word, 2))
+	return lines
+
+#generates the section of a page for one language
+def generate_language(r, word, lang):
+	lines = ['=='+lang+'==', '']
+	for header in r.sample(HEADERS, r.randint(1, 4)):
+		if r.random() < 0.7: lines.append('==='+header+'===')
+		else: lines.append('===='+header+'====')
+		lines.append('{{en-'+header.lower()+'}}')
+		lines.append('')
+		for _ in range(r.randint(1, 5)):
+			lines.extend(generate_sense(r, word, 1))
+		lines.append('')
+		if r.random() < 0.3:
+			lines.extend(['====Synonyms====', '* {{l|en|'+r.choice(FILLER)+'}}', ''])
+	return lines
+
+#generates the xml lines of the i-th page of the dump
+def generate_page(r, i):
+	if r.random() < 0.1:
+		title = r.choice(NAMESPACES)+':'+r.choice(FILLER)
+		ns = '4'
+	else:
+		title = r.choice(WORDS)+str(i)
+		ns = '0'
+
+	#most pages have no English section
+	langs = r.sample(LANGUAGES, r.randint(1, 3))
+	if r.random() < 0.4: langs = [l for l in langs if l != 'English'] or ['French']
+	if r.random() < 0.05: #page without language headers
+		body = generate_language(r, title, 'English')[2:]
+	else:
+		body = []
+		for j, lang in enumerate(langs):
+			if j > 0: body.append('----')
+			body.extend(generate_language(r, title, lang))
+	text = '\n'.join(body)
+	sha1 = hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+	return ['  <page>',
+		'    <title>'+title+'</title>',
+		'    <ns>'+ns+'</ns>',
+		'    <id>'+str(i)+'</id>',
+		'    <revision>',
+		'      <id>'+str(1000000+i)+'</id>',
+		'      <timestamp>2020-01-01T00:00:00Z</timestamp>',
+		'      <contributor>',
+		'        <username>Bot</username>',
+		'        <id>1</id>',
+		'      </contributor>',
+		'      <model>wikitext</model>',
+		'      <format>text/x-wiki</format>',
+		'      <text bytes="'+str(len(text))+'" xml:space="preserve">'+text+'</text>',
+		'      <sha1>'+sha1+'</sha1>',
+		'    </revision>',
+		'  </page>']
+
+#writes a synthetic dump with the given number of pages to filepath
+def generate_dump(filepath, pages, seed=0):
+	r = random.Random(seed)
+	with open(filepath, 'w', encoding='utf-8') as f:
+		f.write('<mediawiki xml:lang="en">\n')
+		f.write('  <siteinfo>\n    <sitename>Wiktionary</sitename>\n  </siteinfo>\n')
+		for i in range(pages):
+			f.write('\n'.join(generate_page(r, i))+'\n')
+		f.write('</mediawiki>\n')
+	return
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	generate_dump(args.out_file, args.pages, args.seed)
+
+#EOF
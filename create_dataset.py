@@ -0,0 +1,248 @@
+'''
+Copyright (c) Facebook, Inc. and its affiliates.
+All rights reserved.
+This source code is licensed under the license found in the
+LICENSE file in the root directory of this source tree.
+'''
+
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+from utils import *
+
+'''
+This script creates the FEWS dataset from a Wiktionary dump. The build is a set of stages
+with declared inputs and outputs; the content hashes of the inputs and outputs of each stage
+are recorded, so a stage is only run again when its inputs (including the scripts it runs)
+or parameters changed, or its outputs are missing or were modified. Stages whose inputs
+are ready run concurrently.
+'''
+
+parser = argparse.ArgumentParser(description='FEWS Dataset Build')
+parser.add_argument('--wiki-file', type=str, required=True,
+	help='Filepath to the Wiktionary dump file to be parsed')
+parser.add_argument('--wiki-index', type=str, default=None,
+	help='Filepath to the multistream index of a .xml.bz2 dump')
+parser.add_argument('--out-dir', type=str, default='fews',
+	help='Directory in which to build the dataset')
+parser.add_argument('--workers', type=int, default=1,
+	help='Number of processes used by the parsing and splitting scripts')
+parser.add_argument('--force', type=str, nargs='*', default=[],
+	help='Stages to run even if they are up to date')
+parser.add_argument('--dry-run', action='store_true',
+	help='Print the stages that would be run, and why, without running them')
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = 'build_state.json' #hashes recorded for each stage, in the out dir
+
+#files of the dataset made by splitting, and where they go in the out dir
+SPLIT_FILES = {'train.txt': 'train/train.txt',
+	'train.ext.txt': 'train/train.ext.txt',
+	'dev.few-shot.txt': 'dev/dev.few-shot.txt',
+	'dev.zero-shot.txt': 'dev/dev.zero-shot.txt',
+	'test.few-shot.txt': 'test/test.few-shot.txt',
+	'test.zero-shot.txt': 'test/test.zero-shot.txt',
+	'monosemous.txt': 'raw/monosemous.txt'}
+
+#a stage of the build: run() makes the outputs from the inputs (filepaths), and params are
+#whatever else its outputs depend on (e.g. command line options)
+class Stage:
+	def __init__(self, name, inputs, outputs, run, params=None):
+		self.name = name
+		self.inputs = inputs
+		self.outputs = outputs
+		self.run = run
+		self.params = params or {}
+
+#runs a python script of this repo
+def run_script(script, *args):
+	subprocess.run([sys.executable, os.path.join(REPO_DIR, script)]+list(args), check=True)
+
+def copy_file(src, dst):
+	def run():
+		shutil.copyfile(src, dst)
+	return run
+
+#the stages of the build, in the order create_dataset.sh ran them
+def build_stages(args):
+	out = args.out_dir
+	raw = os.path.join(out, 'raw')
+	raw_files = [os.path.join(raw, name) for name in ['senses.txt', 'quotations.txt', 'examples.txt']]
+	def script_inputs(*names):
+		return [os.path.join(REPO_DIR, name) for name in names]
+
+	#the number of workers does not change the outputs, so it is not a parameter
+	parse_args = ['--wiki-file', args.wiki_file, '--save-dir', raw]
+	if args.wiki_index is not None: parse_args += ['--wiki-index', args.wiki_index]
+	def parse():
+		run_script('data_parsing.py', *parse_args, '--workers', str(args.workers))
+	parse_inputs = [args.wiki_file]+([args.wiki_index] if args.wiki_index else [])
+	parse_inputs += script_inputs('data_parsing.py', 'utils.py', 'instrumentation.py')
+
+	#split into a staging dir, then move each file to its place in the dataset
+	split_dir = os.path.join(out, 'split')
+	def split():
+		if not os.path.exists(split_dir): os.makedirs(split_dir)
+		run_script('split_data.py', '--raw-dir', raw, '--save-dir', split_dir, '--workers', str(args.workers))
+		for name, path in SPLIT_FILES.items():
+			os.replace(os.path.join(split_dir, name), os.path.join(out, path))
+		shutil.rmtree(split_dir)
+
+	return [Stage('parse', parse_inputs, raw_files, parse, {'args': parse_args}),
+		Stage('split', raw_files+script_inputs('split_data.py', 'utils.py'),
+			[os.path.join(out, path) for path in SPLIT_FILES.values()], split),
+		#senses.txt is copied rather than moved, so the parse stage stays up to date
+		Stage('senses', [raw_files[0]], [os.path.join(out, 'senses.txt')],
+			copy_file(raw_files[0], os.path.join(out, 'senses.txt'))),
+		#python utils for loading/saving data, readme and datasheet
+		Stage('utils', script_inputs('utils.py'), [os.path.join(out, 'dataset-utils.py')],
+			copy_file(os.path.join(REPO_DIR, 'utils.py'), os.path.join(out, 'dataset-utils.py'))),
+		Stage('readme', script_inputs('dataset_README.txt'), [os.path.join(out, 'README.txt')],
+			copy_file(os.path.join(REPO_DIR, 'dataset_README.txt'), os.path.join(out, 'README.txt'))),
+		Stage('datasheet', script_inputs('datasheet.pdf'), [os.path.join(out, 'datasheet.pdf')],
+			copy_file(os.path.join(REPO_DIR, 'datasheet.pdf'), os.path.join(out, 'datasheet.pdf')))]
+
+#content hashes of files, reusing those recorded for files whose size and mtime are unchanged
+#(hashes maps paths to [size, mtime_ns, hash], and is updated with the new hashes)
+class FileHashes:
+	def __init__(self, hashes):
+		self.hashes = hashes
+		self.lock = threading.Lock()
+
+	#hash of a file, or None if it doesn't exist
+	def get(self, path):
+		if not os.path.exists(path): return None
+		stamps = file_stamps([path])
+		with self.lock:
+			known = self.hashes.get(path)
+		if known is not None and known[:2] == stamps: return known[2]
+		h = file_hash(path)
+		with self.lock:
+			self.hashes[path] = stamps+[h]
+		return h
+
+#the reason a stage has to run, or None if it is up to date with the record of its last run
+def stage_changes(stage, record, hashes):
+	if record is None: return 'never run'
+	if record['params'] != stage.params: return 'parameters changed'
+	for path in stage.inputs:
+		if hashes.get(path) != record['inputs'].get(path): return 'input {} changed'.format(path)
+	for path in stage.outputs:
+		h = hashes.get(path)
+		if h is None: return 'output {} is missing'.format(path)
+		if h != record['outputs'].get(path): return 'output {} was modified'.format(path)
+	return None
+
+#records the hashes of the inputs and outputs of a stage that was run
+def stage_record(stage, hashes):
+	return {'params': stage.params,
+		'inputs': {path: hashes.get(path) for path in stage.inputs},
+		'outputs': {path: hashes.get(path) for path in stage.outputs}}
+
+def load_state(filepath):
+	if not os.path.exists(filepath): return {'stages': {}, 'files': {}}
+	with open(filepath, 'r') as f:
+		return json.load(f)
+
+def save_state(filepath, state):
+	with open(filepath+'.tmp', 'w') as f:
+		json.dump(state, f, indent=1, sort_keys=True)
+		f.write('\n')
+	os.replace(filepath+'.tmp', filepath)
+
+#stages that must run before each stage: those making its inputs
+def stage_dependencies(stages):
+	made_by = {path: s.name for s in stages for path in s.outputs}
+	return {s.name: set(made_by[path] for path in s.inputs if path in made_by) for s in stages}
+
+#prints the stages that would be run; a stage after one that would run may find its inputs
+#unchanged once that one has run, and be skipped then
+def dry_run(stages, state, hashes, force):
+	deps = stage_dependencies(stages)
+	runs = set()
+	for stage in stages:
+		reason = stage_changes(stage, state['stages'].get(stage.name), hashes)
+		if stage.name in force: reason = 'forced'
+		if reason is None:
+			after = sorted(deps[stage.name] & runs)
+			if len(after) > 0: reason = 'may run, after {}'.format(', '.join(after))
+		if reason is None: print('{}: up to date'.format(stage.name))
+		else:
+			print('{}: {}'.format(stage.name, reason))
+			runs.add(stage.name)
+
+#runs the stages that are not up to date, each as soon as the stages it depends on are done,
+#concurrently with the others that are ready; the state is saved after each stage
+def run_stages(stages, state, hashes, force, state_path):
+	deps = stage_dependencies(stages)
+	done = set()
+	pending = list(stages)
+	running = {}
+	lock = threading.Lock()
+
+	#runs a stage unless it is up to date (checked once the stages before it are done)
+	def run(stage):
+		reason = 'forced' if stage.name in force else stage_changes(stage, state['stages'].get(stage.name), hashes)
+		if reason is None:
+			print('{}: up to date'.format(stage.name), flush=True)
+			return
+		print('{}: running ({})'.format(stage.name, reason), flush=True)
+		for path in stage.outputs:
+			if not os.path.exists(os.path.dirname(path)): os.makedirs(os.path.dirname(path), exist_ok=True)
+		stage.run()
+		record = stage_record(stage, hashes)
+		with lock:
+			state['stages'][stage.name] = record
+			#the recorded file hashes are updated by the other stages' threads
+			with hashes.lock: save_state(state_path, state)
+		print('{}: done'.format(stage.name), flush=True)
+
+	failed = None
+	with concurrent.futures.ThreadPoolExecutor(max_workers=len(stages)) as pool:
+		while len(pending) > 0 or len(running) > 0:
+			if failed is None:
+				for stage in [s for s in pending if deps[s.name] <= done]:
+					pending.remove(stage)
+					running[pool.submit(run, stage)] = stage
+			if len(running) == 0: break
+			finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in finished:
+				stage = running.pop(future)
+				if future.exception() is not None:
+					print('{}: failed'.format(stage.name), flush=True)
+					if failed is None: failed = future.exception()
+				else: done.add(stage.name)
+	#keep the hashes of files checked by stages that were up to date
+	save_state(state_path, state)
+	if failed is not None: raise failed
+
+def main(args):
+	if not os.path.exists(args.out_dir):
+		os.makedirs(args.out_dir)
+	state_path = os.path.join(args.out_dir, STATE_FILE)
+	state = load_state(state_path)
+	hashes = FileHashes(state['files'])
+	stages = build_stages(args)
+	for name in args.force:
+		if name not in [s.name for s in stages]: raise ValueError('unknown stage: {}'.format(name))
+
+	if args.dry_run:
+		dry_run(stages, state, hashes, set(args.force))
+	else:
+		run_stages(stages, state, hashes, set(args.force), state_path)
+	return
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	main(args)
+
+#EOF
@@ -9,12 +9,28 @@ LICENSE file in the root directory of this source tree.
 # -*- coding: utf-8 -*-
 
 import argparse
+import bz2
+import collections
+import copy
+import functools
+import hashlib
+import itertools
+import json
+import mmap
+import multiprocessing
+import pickle
+import queue
 import re
 import os
+import sqlite3
+import sys
+import threading
 import time
+import traceback
 from difflib import SequenceMatcher
 
 from utils import *
+import instrumentation
 
 '''
 This script takes in a Wiktionary dump file and parses it into 
@@ -23,15 +39,48 @@ a fow-shot WSD dataset.
 
 parser = argparse.ArgumentParser(description='FEWS Dataset Creation Script')
 parser.add_argument('--wiki-file', type=str, required=True,
-	help='Filepath to the Wiktionary dump file to be parsed')
+	help='Filepath to the Wiktionary dump file to be parsed (.xml, or .xml.bz2 including multistream dumps)')
+parser.add_argument('--wiki-index', type=str, default=None,
+	help='Filepath to the multistream index of a .xml.bz2 dump; lets its streams be decompressed in parallel')
 parser.add_argument('--save-dir', type=str, required=True,
 	help='Filepath at which to save parsed Wikitionary pages')
+parser.add_argument('--workers', type=int, default=1,
+	help='Number of processes used to parse pages in parallel (1 parses serially)')
+parser.add_argument('--cache-file', type=str, default=None,
+	help='Filepath of a cache of parsed pages, reused by later builds for pages whose revision is unchanged')
+parser.add_argument('--resume', action='store_true',
+	help='Continue an interrupted run from the last checkpoint saved in the save dir')
+parser.add_argument('--checkpoint-interval', type=float, default=300,
+	help='Seconds between checkpoints of the run, from which --resume can continue it')
+parser.add_argument('--no-mmap', action='store_true',
+	help='Read an uncompressed dump line by line instead of splitting its pages from a memory map')
+parser.add_argument('--languages', type=str, nargs='+', default=['English'],
+	help='Languages whose sections are extracted, in one pass over the dump (languages other than English are saved to a subdirectory of the save dir each)')
+parser.add_argument('--profile', type=str, default=None, choices=['cprofile', 'sample'],
+	help='Profile the run (main process only, all threads) with cProfile or a sampling profiler; results go in the run report')
 
 #parts-of-speech we track for senses 
 PARTS_OF_SPEECH = ['noun', 'verb', 'adjective', 'adverb', 'proper noun']
+#parts-of-speech headers of each language, for languages whose sections don't use those of
+#PARTS_OF_SPEECH (the english wiktionary uses english headers for every language)
+LANGUAGE_PARTS_OF_SPEECH = {'English': PARTS_OF_SPEECH}
+LANGUAGES = ('English',) #languages whose senses are extracted by default
 
 CHAR_THRESHOLD = 9 #examples should contain 15+ chars
 MIN_MENTION_RATIO = 0.5 #mention of sense overlaps this % with base sense form
+PAGE_BATCH_SIZE = 64 #number of pages sent to a worker process at a time
+MAX_PENDING_BATCHES = 4 #batches in flight per worker before reading waits on parsing
+STREAM_BATCH_SIZE = 8 #number of multistream bz2 blocks sent to a worker process at a time
+CACHE_COMMIT_SIZE = 1000 #number of newly parsed pages written to the page cache per transaction
+MENTION_CACHE_SIZE = 2**18 #number of (mention, word) decisions memoized by is_mention
+PIPELINE_QUEUE_SIZE = 256 #items held in each queue between two stages of the parsing pipeline
+
+#precompiled patterns used by process_page
+HTML_ELEMENT_RE = re.compile('<.*?>.*?</.*?>')
+HTML_TAG_RE = re.compile('<.*?>')
+LANG_HEADER_RE = re.compile(r'^==[^=]*?==$')
+#header lines without html (but maybe after the <text> tag), see prefilter_page_bytes
+BYTES_LANG_HEADER_RE = re.compile(rb'^[ \t]*(?:<text[^<>\r\n]*>[ \t]*)?==[^=<\r\n]*==[ \t]*$', re.M)
 
 #calculates longest common subsequence between two strings
 def lcs(str1, str2):
@@ -42,90 +91,209 @@ def lcs(str1, str2):
 	else:
 		return ''
 
+#builds the suffix automaton of a string: its states' transitions, suffix links and
+#longest lengths. every substring of the string is a path from state 0
+@functools.lru_cache(maxsize=2**14)
+def suffix_automaton(string):
+	nexts = [{}]
+	links = [-1]
+	lengths = [0]
+	last = 0
+	for c in string:
+		cur = len(nexts)
+		nexts.append({})
+		links.append(-1)
+		lengths.append(lengths[last]+1)
+		p = last
+		while p != -1 and c not in nexts[p]:
+			nexts[p][c] = cur
+			p = links[p]
+		if p == -1:
+			links[cur] = 0
+		else:
+			q = nexts[p][c]
+			if lengths[p]+1 == lengths[q]:
+				links[cur] = q
+			else:
+				clone = len(nexts)
+				nexts.append(dict(nexts[q]))
+				links.append(links[q])
+				lengths.append(lengths[p]+1)
+				while p != -1 and nexts[p].get(c) == q:
+					nexts[p][c] = clone
+					p = links[p]
+				links[q] = clone
+				links[cur] = clone
+		last = cur
+	return nexts, links, lengths
+
+#checks whether a bolded span in a quote/example is a mention of word, i.e. whether their
+#longest common substring covers more than MIN_MENTION_RATIO of the span (as measured by lcs).
+#the span is run through the suffix automaton of word in linear time, stopping as soon as
+#the ratio is reached or can no longer be reached; decisions are memoized since the same
+#inflections of common words come up over and over
+@functools.lru_cache(maxsize=MENTION_CACHE_SIZE)
+def is_mention(value, word):
+	if len(value) == 0: return False
+	text = value.lower()
+	#SequenceMatcher ignores popular characters of strings this long (autojunk),
+	#so keep its exact behaviour for them
+	if len(word) >= 200:
+		return len(lcs(text, word))/len(value) > MIN_MENTION_RATIO
+	if min(len(text), len(word))/len(value) <= MIN_MENTION_RATIO: return False
+
+	nexts, links, lengths = suffix_automaton(word)
+	state = 0
+	match = 0
+	best = 0
+	for i, c in enumerate(text):
+		while state != 0 and c not in nexts[state]:
+			state = links[state]
+			match = lengths[state]
+		if c in nexts[state]:
+			state = nexts[state][c]
+			match += 1
+		if match > best:
+			best = match
+			if best/len(value) > MIN_MENTION_RATIO: return True
+		#longest match still possible: the current one running to the end of the span
+		if min(len(word), max(best, match+len(text)-i-1))/len(value) <= MIN_MENTION_RATIO:
+			return False
+	return False
+
+#precompiled patterns used by clean_text
+CATEGORY_RE = re.compile(r'\[\[Category:.*?\]\]')
+FILE_RE = re.compile(r'\[\[File:.*?\]\]')
+USAGE_RE = re.compile(r'/ :*? \'\'\'Usage.*$')
+TEMPLATE_RE = re.compile(r'{{.*?}}')
+TEMPLATE_MARKS_RE = re.compile(r'{{|}}')
+LINK_RE = re.compile(r'\[\[.*?\]\]')
+LINK_MARKS_RE = re.compile(r'\[\[|\]\]')
+BOLD_RE = re.compile(r'\'\'\'.*?\'\'\'')
+WSD_RE = re.compile(r'<WSD>.*?</WSD>')
+
+#html entities and math/superscript tags, replaced in one pass with a table lookup;
+#&amp; is decoded before the space entities and the brackets before the tags, so the
+#table also holds the combined forms (e.g. &amp;nbsp; and &lt;sup&gt;)
+ENTITIES = {'&lt;': '<', '&gt;': '>', '&amp;': '&',
+	'&nbsp;': ' ', '&emsp;': ' ', '&hellip;': '...',
+	'&amp;nbsp;': ' ', '&amp;emsp;': ' ', '&amp;hellip;': '...'}
+for tag in ('math', '/math', 'sup', '/sup'):
+	for open_b in ('<', '&lt;'):
+		for close_b in ('>', '&gt;'):
+			ENTITIES[open_b+tag+close_b] = ''
+#math symbols and line breaks; kept as a second pass since removing the tags above can
+#join text into one of these
+SYMBOLS = {'\\forall': '∀', '\\exists': '∃', '\\pi': 'π', '\\dot': '·', '<br>': '/ ', '<br/>': '/ '}
+#longest alternatives first, so combined forms win over their prefixes
+ENTITY_RE = re.compile('|'.join(re.escape(e) for e in sorted(ENTITIES, key=len, reverse=True)))
+SYMBOL_RE = re.compile('|'.join(re.escape(e) for e in sorted(SYMBOLS, key=len, reverse=True)))
+QUOTE_RE = re.compile(r'&quot;|(?<!\')\'{2}(?!\')|&ldquo;|&rdquo;')
+
+#replaces each match of pattern in text with the value get_value computes from it, building
+#the result in one pass. the replacements used to be applied one at a time with re.sub(count=1),
+#so values that re.sub would expand (backslashes) or that start/end with one of the joins
+#characters (and so could merge with neighbouring text into a new match) fall back to that
+def replace_matches(pattern, text, get_value, joins=''):
+	matches = list(pattern.finditer(text))
+	if len(matches) == 0: return text
+	values = [get_value(m.group(0)) for m in matches]
+
+	for value in values:
+		if '\\' in value or (len(value) > 0 and (value[0] in joins or value[-1] in joins)):
+			for value in values:
+				text = pattern.sub(value, text, count=1)
+			return text
+
+	pieces = []
+	pos = 0
+	for m, value in zip(matches, values):
+		pieces.append(text[pos:m.start()])
+		pieces.append(value)
+		pos = m.end()
+	pieces.append(text[pos:])
+	return ''.join(pieces)
+
+#gets the text shown for a template, e.g. {{w|Paris}} -> (Paris)
+def template_value(value):
+	value = TEMPLATE_MARKS_RE.sub('', value)
+	return '('+value.strip().split('|')[-1]+')'
+
+#gets the text shown for a link, e.g. [[w:Paris|Paris]] -> Paris
+def link_value(value):
+	value = LINK_MARKS_RE.sub('', value)
+	value = ''+value.strip().split('|')[-1]+''
+	if value == '\\': value = '\\\\'
+	return value
+
 #cleans text from wikipedia to get rid of meta data, wiki markup, html formatting
 def clean_text(text, match_sense=''):
 	#get rid of meta data
-	text = re.sub(r'\[\[Category:.*?\]\]', '', text)
-	text = re.sub(r'\[\[File:.*?\]\]', '', text)
-	text = re.sub(r'/ :*? \'\'\'Usage.*$', '', text)
-
+	if '[[' in text:
+		text = CATEGORY_RE.sub('', text)
+		text = FILE_RE.sub('', text)
+	if '\'\'\'Usage' in text:
+		text = USAGE_RE.sub('', text)
 
 	#fix math+ symbols
-	text = re.sub(r'&lt;', '<', text)
-	text = re.sub(r'&gt;', '>', text)
-	text = re.sub(r'&amp;', '&', text)
-	text = re.sub(r'&nbsp;|&emsp;', ' ', text)
-	text = re.sub(r'&hellip;', '...', text)
-	text = re.sub(r'<math>|</math>|<sup>|</sup>', '', text)
-	text = re.sub(r'\\forall', '∀', text)
-	text = re.sub(r'\\exists', '∃', text)
-	text = re.sub(r'\\pi', 'π', text)
-	text = re.sub(r'\\dot', '·', text)
-	text = re.sub(r'<br/?>', '/ ', text)
+	if '&' in text or '<' in text:
+		text = ENTITY_RE.sub(lambda m: ENTITIES[m.group(0)], text)
+	if '\\' in text or '<' in text:
+		text = SYMBOL_RE.sub(lambda m: SYMBOLS[m.group(0)], text)
 
 	#parse these metadata links out
-	matches = re.finditer(r'{{.*?}}', text)
-	for m in matches:
-		value = m.group(0)
-		value = re.sub(r'{{|}}', '', value)
-		value = '('+value.strip().split('|')[-1]+')'
-		text = re.sub(r'{{.*?}}', value, text, count=1)
+	if '{{' in text:
+		text = replace_matches(TEMPLATE_RE, text, template_value)
 
 	#parse out links
-	matches = re.finditer(r'\[\[.*?\]\]', text)
-	for m in matches:
-		value = m.group(0)
-		value = re.sub(r'\[\[|\]\]', '', value)
-		value = ''+value.strip().split('|')[-1]+''
-		if value == '\\': value = '\\\\'
-		text = re.sub(r'\[\[.*?\]\]', value, text, count=1)
-	text = re.sub(r'\[\[|\]\]', '', text)
+	if '[[' in text or ']]' in text:
+		text = replace_matches(LINK_RE, text, link_value, joins='[')
+		text = LINK_MARKS_RE.sub('', text)
 
-
-	text = re.sub(r'{{|}}', '', text)
+	if '{{' in text or '}}' in text:
+		text = TEMPLATE_MARKS_RE.sub('', text)
 
 	if match_sense != '':
 		word = match_sense.split('.')[0].replace('_', ' ')
-		matches = re.finditer(r'\'\'\'.*?\'\'\'', text)
-		for m in matches:
-			value = m.group(0)
-			value = re.sub(r'\'\'\'', '', value)
-			if len(value) > 0 and len(lcs(value.lower(), word))/len(value) > MIN_MENTION_RATIO: 
-				text = re.sub(r'\'\'\'.*?\'\'\'', '<WSD>'+value+'</WSD>', text, count=1)
+		def mention_value(value):
+			value = value.replace('\'\'\'', '')
+			if is_mention(value, word): 
+				return '<WSD>'+value+'</WSD>'
 			else:
-				text = re.sub(r'\'\'\'.*?\'\'\'', value, text, count=1)
+				return value
+		text = replace_matches(BOLD_RE, text, mention_value)
 
 	#fix quotation marks
-	text = re.sub(r'’', '\'', text)
-	text = re.sub(r'&quot;', '"', text)
-	text = re.sub(r'(?<!\')\'{2}(?!\')', '"', text)
-	text = re.sub(r'&ldquo;|&rdquo;', '"', text)
+	text = text.replace('’', '\'')
+	if '&' in text or '\'\'' in text:
+		text = QUOTE_RE.sub('"', text)
 
 	#cleaning whitespace in text
 	text = ' '.join([t.strip() for t in text.split(' ')])
 
 	text = text.strip()
 	if match_sense != '':
-		context = re.sub(r'<WSD>.*?</WSD>', '', text)
+		context = WSD_RE.sub('', text)
 		if '<WSD>' in text and ' ' in context:
 			return text
 		else:
+			if '<WSD>' not in text: instrumentation.count('dropped_mention_no_wsd')
+			else: instrumentation.count('dropped_mention_no_context')
 			return ''
 	else:
 		return text
 
 #creates a new sense object for the given word and pos
 def generate_sense(word, pos):
-	s = {'word':word,
-		'gloss':'', 
-		'pos': pos,
-		'tags':[],
-		'examples':[],
-		'quotations':[],
-		'synonyms':[],
-		'depth':-1}
+	s = Sense(word, pos)
 	return s
 
+#interns the fragments of a quotation's attribution (a list of template arguments,
+#many repeated across quotes, e.g. en or year=...) as a tuple
+def intern_attribution(q_tags):
+	if isinstance(q_tags, list): return tuple(sys.intern(t) for t in q_tags)
+	return q_tags
+
 #processes the gloss contained in given line
 def process_gloss(line):
 	depth = len(line)-len(line.lstrip('#')) #to get number of # at beginning of line
@@ -138,6 +306,7 @@ def process_gloss(line):
 
 	#ignore senses with no gloss or only tags in gloss (not text)
 	if len(gloss) == 0 or len(re.sub(r'\(.*?\)\.?', '', gloss.strip())) == 0: 
+		instrumentation.count('dropped_gloss_empty')
 		return -1, -1, -1 
 	
 	#parse tags
@@ -156,6 +325,7 @@ def process_example(line):
 	if len(ex) > CHAR_THRESHOLD and ' ' in ex:
 		return ex
 	else:
+		instrumentation.count('dropped_example_too_short')
 		return -1
 
 #processes the synonyms in a given line
@@ -173,6 +343,7 @@ def process_quotation(line):
 	line = re.sub(r'#*?\*:?', '', line)
 
 	if 'seemorecites' in line.lower():
+		instrumentation.count('dropped_quotation_seemorecites')
 		return -1, -1
 
 	if '|| QUOTE=' in line:
@@ -205,6 +376,7 @@ def process_quotation(line):
 				q = q[-1]
 				q_tags = [t for t in q_tags if t != q]
 			else:
+				instrumentation.count('dropped_quotation_no_text')
 				return -1, -1
 
 	#assuming the quote is here in quotes
@@ -223,6 +395,7 @@ def process_quotation(line):
 	if len(q) > CHAR_THRESHOLD and ' ' in q:
 		return q, q_tags
 	else:
+		instrumentation.count('dropped_quotation_too_short')
 		return -1, -1
 
 #compresses split line that contain shared (quotation) information
@@ -256,7 +429,10 @@ def process_sense(lines, word, pos):
 	if gloss == -1: return -1
 	sense['gloss'] = gloss
 	sense['depth'] = depth
-	sense['tags'].extend(tags)
+	sense['tags'] = intern_tags(tags)
+	examples = []
+	synonyms = []
+	quotations = []
 
 	#clean up lines formatting
 	lines = compress_lines(lines[1:])
@@ -268,20 +444,24 @@ def process_sense(lines, word, pos):
 			if re.match(r'#*?: {{ux', line):
 				ex = process_example(line)
 				if ex != -1:
-					sense['examples'].append(ex)
+					examples.append(ex)
 
 			#synonyms
 			elif re.match(r'#*?: {{syn', line):
 				syn = process_synonym(line)
-				sense['synonyms'].extend(syn)
+				synonyms.extend(syn)
 
 			#quotes
 			elif re.match(r'#*?\* ', line):
 				q, q_tags = process_quotation(line)
 				if q != -1:
-					quote = (q, q_tags)
-					sense['quotations'].append(quote)
+					quote = (q, intern_attribution(q_tags))
+					quotations.append(quote)
 
+	#senses without any share the empty tuple
+	sense['examples'] = tuple(examples)
+	sense['synonyms'] = tuple(synonyms)
+	sense['quotations'] = tuple(quotations)
 	return sense
 
 #processes senses of a given pos for the given word
@@ -309,22 +489,22 @@ def process_pos(lines, word, pos):
 
 	return senses
 
-#processes the senses in a language (EN) for a given word
-def process_language(word, lines):
+#processes the senses in a language for a given word, given the pos headers of that language
+def process_language(word, lines, parts_of_speech=PARTS_OF_SPEECH):
 	senses = []
 	pos = ''
 	pos_lines = []
 
 	for line in lines:
 		if line.startswith('='):
-			if line.strip('=').lower() in PARTS_OF_SPEECH: 
-				if pos in PARTS_OF_SPEECH:
+			if line.strip('=').lower() in parts_of_speech: 
+				if pos in parts_of_speech:
 					#clean up
 					s = process_pos(pos_lines, word, pos)
 					senses.extend(s)
 					pos_lines = []
 				pos = line.strip('=').lower()
-			elif pos in PARTS_OF_SPEECH:
+			elif pos in parts_of_speech:
 				s = process_pos(pos_lines, word, pos)
 				senses.extend(s)
 				pos_lines = []
@@ -343,64 +523,120 @@ def process_language(word, lines):
 	else:
 		return -1
 
-#processes a wiktionary page for a specific word into a list of senses of that word
-def process_page(lines):
-	senses = []
+#processes a wiktionary page for a specific word into the senses of that word in each of
+#the given languages, as a dict of language -> list of senses (of the languages with senses)
+def process_page_languages(lines, languages=LANGUAGES):
+	senses = {}
+	def add_senses(lang, lang_lines):
+		l = process_language(title, lang_lines, LANGUAGE_PARTS_OF_SPEECH.get(lang, PARTS_OF_SPEECH))
+		if l != -1: 
+			senses.setdefault(lang, []).extend(l)
 
 	#get title/word for page
-	title = [line.replace('<title>', '').replace('</title>', '') for line in lines if line.startswith('<title>')][0]
+	title = next(line for line in lines if line.startswith('<title>')).replace('<title>', '').replace('</title>', '')
 	#ignoring structural, management pages
-	if re.match(r'^\w*?:', title): return -1 #ignore these pages
+	if re.match(r'^\w*?:', title): #ignore these pages
+		instrumentation.count('dropped_page_namespace_title')
+		return -1
 	else: word = title
 
 	#remove html from text to process clean page
 	l = []
 	for line in lines:
-		line = re.sub('<.*?>.*?</.*?>', '', line)
-		line = re.sub('<.*?>', '', line)
-		line = line.strip()
+		line = strip_html(line)
 		if len(line) != 0: l.append(line)
-	if len(l) == 0: return -1 #ignore pages with no text outside of html code
+	if len(l) == 0: #ignore pages with no text outside of html code
+		instrumentation.count('dropped_page_no_text')
+		return -1
 	else: lines = l
 
-	#check if there are languages, and process each language seperately 
-	langs_count = len([1 for line in lines if re.match(r'^==[^=]*?==$', line)])
+	#check if there are languages, and process each language seperately;
+	#only the lines of sections of the given languages are kept for process_language
+	langs_count = 0
+	in_lang = False
+	has_lang = False
+	lang_lines = []
+	lang = ''
+	for line in lines:
+		if is_lang_header(line):
+			langs_count += 1
+			lang = line.replace('==', '')
+			lang_lines = []
+			if lang in languages: in_lang = has_lang = True
+			else: in_lang = False 
+		elif in_lang:
+			if line == '----':
+				add_senses(lang, lang_lines)
+				in_lang = False
+				lang_lines = []
+			else:
+				lang_lines.append(line)
 
 	if langs_count > 0:
-		in_lang = False
-		lang_lines = []
-		lang = ''
-		for line in lines:
-			if re.match(r'^==[^=]*?==$', line):
-				lang = line.replace('==', '')
-				lang_lines = []
-				if lang == 'English': in_lang = True
-				else: in_lang = False 
-			elif in_lang:
-				if line == '----':
-					l = process_language(title, lang_lines)
-					if l != -1: 
-						senses.extend(l)
-					in_lang = False
-					lang_lines = []
-				else:
-					lang_lines.append(line)
 		#process last language 
 		if in_lang:
-			l = process_language(title, lang_lines)
-			if l != -1: 
-				senses.extend(l)
+			add_senses(lang, lang_lines)
+		if not has_lang:
+			instrumentation.count('dropped_page_no_language')
+			return -1
 	#otherwise assumed to be only English and processed as one language
-	else:
-		l = process_language(title, lines)
-		if l != -1: 
-			senses.extend(l)
+	elif 'English' in languages:
+		add_senses('English', lines)
 
 	if len(senses) > 0:
 		return senses
 	else:
+		instrumentation.count('dropped_page_no_senses')
 		return -1
 
+#processes a wiktionary page for a specific word into a list of (English) senses of that word
+def process_page(lines):
+	senses = process_page_languages(lines)
+	if senses == -1: return -1
+	return senses['English']
+
+#removes html elements and tags from a (stripped) line of a page; lines without
+#a < are left as they are, without running the regexes
+def strip_html(line):
+	if '<' in line:
+		line = HTML_ELEMENT_RE.sub('', line)
+		line = HTML_TAG_RE.sub('', line)
+	return line.strip()
+
+#checks if a line (with html removed) is a language header, e.g. ==English==
+def is_lang_header(line):
+	return line.startswith('==') and LANG_HEADER_RE.match(line) is not None
+
+#cheap checks run on each page as it is split from the dump, to skip pages before any
+#per-line regex work that process_page would drop anyway: pages outside the main
+#namespace, and pages with language headers but none of the given languages' (e.g. ==English==)
+#anywhere in them. returns the name of the counter of skipped pages to increment, or None to keep the page
+def prefilter_page(lines, languages=LANGUAGES):
+	headers = ['=={}=='.format(lang) for lang in languages]
+	has_lang = False
+	has_header = False
+	for line in lines:
+		if line.startswith('<ns>') and line != '<ns>0</ns>': return 'skipped_page_namespace'
+		if not has_lang and any(h in line for h in headers): has_lang = True
+		if not has_header and '==' in line and is_lang_header(strip_html(line)): has_header = True
+	if has_header and not has_lang: return 'skipped_page_no_language'
+	return None
+
+#prefilter_page on the raw bytes of a page, to skip pages without decoding them; headers are
+#only recognized on lines without html (other than the opening <text> tag) here, so this skips
+#a subset of the pages prefilter_page does and is followed by it on the decoded lines
+def prefilter_page_bytes(data, languages=LANGUAGES):
+	i = data.find(b'<ns>')
+	if i >= 0:
+		end = data.find(b'\n', i)
+		if end < 0: end = len(data)
+		line = data[data.rfind(b'\n', 0, i)+1:end].decode('utf-8').strip()
+		if line.startswith('<ns>') and line != '<ns>0</ns>': return 'skipped_page_namespace'
+	for lang in languages:
+		if '=={}=='.format(lang).encode('utf-8') in data: return None
+	if BYTES_LANG_HEADER_RE.search(data) is not None: return 'skipped_page_no_language'
+	return None
+
 #generate a word key (word+pos) for given sense
 def generate_word_key(sense):
 	if sense['pos'] == 'proper noun':
@@ -408,31 +644,41 @@ def generate_word_key(sense):
 	else:
 		return '{}.{}'.format(sense['word'].lower().replace(' ','_'), sense['pos']) 
 
-#pulls out quotes and examples from sense objects and 
-#creates a list of each to save seperately
-def post_processing(senses):
+#cleans the quotations and examples of the senses of a page in place, marking mentions of
+#the sense's word, so that this can be done by the parse workers before the senses get ids
+#(clean_text only uses the word of the sense id it matches mentions of).
+#senses can also be given as a dict of language -> senses, from process_page_languages
+def clean_page(senses):
+	if isinstance(senses, dict):
+		for l in senses.values(): clean_page(l)
+		return
+	for s in senses:
+		match_sense = generate_word_key(s)+'.0'
+		s['quotations'] = tuple((clean_text(x, match_sense=match_sense), attrib) for x, attrib in s['quotations'])
+		s['examples'] = tuple(clean_text(x, match_sense=match_sense) for x in s['examples'])
+
+#pulls out quotes and examples from the senses of a single page, labeling each
+#sense with an id from the running per word key counters in word_idxs.
+#cleaned is set if the quotes and examples were already cleaned by clean_page
+def post_process_page(senses, word_idxs, cleaned=False):
 	quotes = []
 	examples = []
 
-	#for each word, pos pair, generate idxs
-	word_keys = set([generate_word_key(s) for s in senses])
-	word_idxs = {}
-	for w in word_keys:
-		word_idxs[w] = 0
-
 	#pull out examples, quotations
 	for s in senses:
 		#generate sense id
 		word_k = generate_word_key(s)
-		s_id = '{}.{}'.format(word_k, word_idxs[word_k])
-		word_idxs[word_k] += 1
+		idx = word_idxs.get(word_k, 0)
+		s_id = '{}.{}'.format(word_k, idx)
+		word_idxs[word_k] = idx+1
 
 		#label with sense_id
 		s['sense_id'] = s_id
 		#pull out any quotes
 		if len(s['quotations']) > 0:
 			for x, attrib in s['quotations']:
-				sent = clean_text(x, match_sense=s_id)
+				if cleaned: sent = x
+				else: sent = clean_text(x, match_sense=s_id)
 				if len(sent) > 0:
 					q = (sent, s_id, attrib)
 					quotes.append(q)
@@ -440,7 +686,8 @@ def post_processing(senses):
 		#pull out any examples
 		if len(s['examples']) > 0:
 			for x in s['examples']:
-				sent = clean_text(x, match_sense=s_id)
+				if cleaned: sent = x
+				else: sent = clean_text(x, match_sense=s_id)
 				if len(sent) > 0:
 					e = (sent, s_id)
 					examples.append(e) 
@@ -450,54 +697,716 @@ def post_processing(senses):
 
 	return senses, quotes, examples
 
-#processes a given wiktionary dump file into a list of senses
-#and lists of quotations and examples with sense-disambiguated examples.
-def main(args):
-	#load wikitionary dump data file
-	start_time = time.time()
-	f = open(args.wiki_file, 'r')
+#pulls out quotes and examples from sense objects and 
+#creates a list of each to save seperately
+def post_processing(senses):
+	#for each word, pos pair, generate idxs
+	word_idxs = {}
+	return post_process_page(senses, word_idxs)
 
-	#track status in file
+#splits the (bytes) lines of a dump file into pages, yielding the bytes of the lines of each page
+#(between its <page> and </page> lines) in dump order, without decoding them
+def split_pages(lines):
 	curr_page = []
 	is_page = False
-
-	#track all info for dataset
-	senses = []
-
-	#scan through file and process pages sequentially 
-	for line in f:
-		line = line.strip()
-		if line == '<page>': 
+	for line in lines:
+		stripped = line.strip()
+		if stripped == b'<page>': 
 			is_page = True
-		elif line == '</page>': 
-			s = process_page(curr_page)
-			if s != -1: senses.extend(s)
+		elif stripped == b'</page>': 
+			yield b''.join(curr_page)
 			is_page = False
 			curr_page = []
 		else:
-			#drop empty lines
-			if is_page and len(line)>0: curr_page.append(line)
+			#empty lines are dropped by decode_page
+			if is_page: curr_page.append(line)
+
+#splits the (bytes) lines of a dump file into pages, yielding the (stripped, non-empty) lines of each page
+#in dump order; pages are read with read_page_bytes, so pages that fail the prefilters are skipped
+#(and counted) if prefilter is set, and pages that aren't valid utf-8 are yielded as PageErrors
+def read_pages(lines, prefilter=True, languages=LANGUAGES):
+	for data in split_pages(lines):
+		page = read_page_bytes(data, prefilter, languages)
+		if page is not None: yield page
+
+MAPPED_DUMPS = {} #uncompressed dump files memory-mapped by this process, by path
+
+#memory-maps an uncompressed dump file (once per process)
+def map_dump(path):
+	if path not in MAPPED_DUMPS:
+		with open(path, 'rb') as f:
+			MAPPED_DUMPS[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	return MAPPED_DUMPS[path]
+
+#finds the next line of a mapped dump that is just tag (and whitespace) from pos on,
+#returning the offsets of the start and end of that line, or None if there is none
+def find_tag_line(mm, tag, pos):
+	while True:
+		i = mm.find(tag, pos)
+		if i < 0: return None
+		start = mm.rfind(b'\n', 0, i)+1
+		end = mm.find(b'\n', i)
+		if end < 0: end = len(mm)
+		if mm[start:end].strip() == tag: return start, end
+		pos = i+len(tag)
+
+#splits an uncompressed dump into pages with byte searches on its memory map, yielding
+#the (start, end) byte offsets of the lines of each page (between its <page> and </page>
+#lines) in dump order, from the given offset on. if given, progress is told the size of
+#the file and how much was read
+def page_ranges(path, progress=None, offset=0):
+	size = os.path.getsize(path)
+	pos = [offset]
+	if progress is not None:
+		progress.total = size
+		progress.position = lambda: pos[0]
+	if size == 0: return
+	mm = map_dump(path)
+	while True:
+		start = find_tag_line(mm, b'<page>', pos[0])
+		if start is None: return
+		end = find_tag_line(mm, b'</page>', start[1])
+		if end is None: return
+		pos[0] = end[1]
+		yield start[1], end[0]
+
+#decodes the bytes of a page into its (stripped, non-empty) lines, as read_pages gives them
+#(splitting lines on universal newlines, as a text mode reader would)
+def page_lines(data, errors='strict'):
+	text = data.decode('utf-8', errors).replace('\r\n', '\n').replace('\r', '\n')
+	lines = [line.strip() for line in text.split('\n')]
+	return [line for line in lines if len(line) > 0]
+
+#decodes the bytes of a page with page_lines; a page that isn't valid utf-8 is returned as a
+#PageError (with its lines decoded with replacement characters) so it is quarantined
+def decode_page(data):
+	try:
+		return page_lines(data)
+	except UnicodeDecodeError as e:
+		instrumentation.count('page_errors')
+		return PageError(page_lines(data, 'replace'), e)
+
+#reads a page from the bytes of its lines; returns its lines, a PageError if it isn't valid
+#utf-8, or None if it was skipped by the prefilters (in which case it is only decoded if needed)
+def read_page_bytes(data, prefilter=True, languages=LANGUAGES):
+	try:
+		skip = prefilter_page_bytes(data, languages) if prefilter else None
+	except UnicodeDecodeError:
+		skip = None #left to decode_page
+	if skip is None:
+		lines = decode_page(data)
+		if isinstance(lines, PageError): return lines
+		if prefilter: skip = prefilter_page(lines, languages)
+	if skip is not None:
+		instrumentation.count(skip)
+		return None
+	return lines
+
+#reads the page stored between two byte offsets of an uncompressed dump (see read_page_bytes)
+def read_page_range(page_range, prefilter=True, languages=LANGUAGES):
+	path, start, end = page_range
+	return read_page_bytes(map_dump(path)[start:end], prefilter, languages)
+
+#yields the lines of each page of an uncompressed dump, like read_pages, splitting
+#the pages from a memory map of the file instead of reading it line by line
+def read_pages_mmap(path, prefilter=True, progress=None, languages=LANGUAGES):
+	for start, end in page_ranges(path, progress):
+		lines = read_page_range((path, start, end), prefilter, languages)
+		if lines is not None: yield lines
+
+#reads and parses the page stored between two byte offsets of a dump, so workers are
+#sent offsets rather than pages; returns None if the page was skipped
+def parse_page_range(page_range, languages=LANGUAGES):
+	with instrumentation.timed('decode'):
+		lines = read_page_range(page_range, languages=languages)
+	if lines is None or isinstance(lines, PageError): return lines
+	return parse_page(lines, languages)
+
+PIPELINE_END = object() #put on a pipeline queue after the last item
+
+#raised in a stage of a pipeline when another stage failed
+class PipelineStopped(Exception):
+	pass
+
+#bounded queue between two stages of a pipeline, which records how full it gets and how long
+#its producer waited on it being full (so the consumer is the bottleneck) and its consumer
+#waited on it being empty (so the producer is)
+class StageQueue:
+	def __init__(self, maxsize, stopped):
+		self.queue = queue.Queue(maxsize)
+		self.maxsize = maxsize
+		self.stopped = stopped
+		self.puts = 0
+		self.depth_sum = 0
+		self.max_depth = 0
+		self.put_wait = 0.0
+		self.get_wait = 0.0
+
+	def put(self, item):
+		depth = self.queue.qsize()
+		self.puts += 1
+		self.depth_sum += depth
+		self.max_depth = max(self.max_depth, depth)
+		start = time.perf_counter()
+		while True:
+			try:
+				self.queue.put(item, timeout=0.1)
+				break
+			except queue.Full:
+				if self.stopped.is_set(): raise PipelineStopped()
+		self.put_wait += time.perf_counter()-start
+
+	def get(self):
+		start = time.perf_counter()
+		while True:
+			try:
+				item = self.queue.get(timeout=0.1)
+				break
+			except queue.Empty:
+				if self.stopped.is_set(): raise PipelineStopped()
+		self.get_wait += time.perf_counter()-start
+		return item
+
+	def depth(self):
+		return self.queue.qsize()
+
+	#yields the items put on the queue until PIPELINE_END
+	def __iter__(self):
+		while True:
+			item = self.get()
+			if item is PIPELINE_END: return
+			yield item
+
+	def stats(self):
+		return {'maxsize': self.maxsize,
+			'max_depth': self.max_depth,
+			'mean_depth': self.depth_sum/max(self.puts, 1),
+			'put_wait_seconds': self.put_wait,
+			'get_wait_seconds': self.get_wait}
+
+#runs stages of work in their own threads, connected by bounded queues, so that they
+#overlap while the memory held between them stays capped (a stage waits when its output
+#queue is full). stages are (name, func) pairs: func is given an iterable of the items of
+#the stage's input queue (None for the first stage) and returns an iterable of items for
+#its output queue (None for the last stage). if a stage fails, the others are stopped and
+#run raises its exception
+class Pipeline:
+	def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE):
+		self.stages = stages
+		self.stopped = threading.Event()
+		self.error = None
+		#queues named by the stage that consumes them
+		self.queues = collections.OrderedDict((name, StageQueue(queue_size, self.stopped)) for name, _ in stages[1:])
+
+	def run_stage(self, func, in_q, out_q):
+		try:
+			with instrumentation.thread_profile():
+				out = func(in_q)
+				if out_q is not None:
+					for item in out:
+						out_q.put(item)
+					out_q.put(PIPELINE_END)
+		except PipelineStopped:
+			pass
+		except BaseException as e:
+			if self.error is None: self.error = e
+			self.stopped.set()
+
+	def run(self):
+		threads = []
+		queues = [None]+list(self.queues.values())+[None]
+		for i, (name, func) in enumerate(self.stages):
+			t = threading.Thread(target=self.run_stage, args=(func, queues[i], queues[i+1]), name=name, daemon=True)
+			t.start()
+			threads.append(t)
+		for t in threads:
+			t.join()
+		if self.error is not None: raise self.error
+
+	#current number of items waiting for each stage, for progress reports
+	def depths(self):
+		return 'queued: '+', '.join('{} {}/{}'.format(name, q.depth(), q.maxsize) for name, q in self.queues.items())
+
+	def stats(self):
+		return {name: q.stats() for name, q in self.queues.items()}
+
+#applies func to each item in order, yielding the results in order. with a process pool,
+#batches of items are sent to the workers; only a bounded number of batches are in
+#flight at once, so a slow consumer never lets its input pile up in memory
+def map_batches(func, items, pool, workers, batch_size):
+	if pool is None:
+		for x in items:
+			yield func(x)
+		return
+
+	items = iter(items)
+	pending = collections.deque()
+	while True:
+		batch = list(itertools.islice(items, batch_size))
+		if len(batch) > 0:
+			pending.append(pool.apply_async(map_list, (func, batch)))
+		if len(pending) == 0: break
+		if len(batch) == 0 or len(pending) >= workers*MAX_PENDING_BATCHES:
+			results, stats = pending.popleft().get()
+			instrumentation.merge_stats(stats)
+			for r in results:
+				yield r
+
+#applies func to each item in a list (run inside a pool worker), returning the
+#results along with the counters and timers collected while doing so
+def map_list(func, items):
+	results = [func(x) for x in items]
+	return results, instrumentation.take_stats()
+
+#runs func(x), returning its result with the counters it incremented (e.g. for one page)
+def call_counted(func, x):
+	with instrumentation.recorded_counts() as counts:
+		result = func(x)
+	return result, dict(counts)
+
+#a page that failed to parse, returned by parse_page in place of its senses
+#so it can be written to the quarantine file instead of stopping the run
+class PageError:
+	def __init__(self, lines, error):
+		self.title = next((line.replace('<title>', '').replace('</title>', '') for line in lines if line.startswith('<title>')), None)
+		self.error = ''.join(traceback.format_exception_only(type(error), error)).strip()
+		self.traceback = traceback.format_exc()
+		self.lines = lines
+
+	def to_json(self):
+		return json.dumps({'title': self.title, 'error': self.error, 'traceback': self.traceback, 'lines': self.lines})
+
+#runs process_page_languages on the lines of a page and cleans its quotes and examples, timing both;
+#pages that could not be decoded (PageErrors) are passed through
+def parse_page(lines, languages=LANGUAGES):
+	if isinstance(lines, PageError): return lines
+	try:
+		with instrumentation.timed('process_page'):
+			senses = process_page_languages(lines, languages)
+		if senses != -1:
+			with instrumentation.timed('clean_page'):
+				clean_page(senses)
+	except Exception as e:
+		instrumentation.count('page_errors')
+		return PageError(lines, e)
+	return senses
+
+#parses pages from the dump, yielding the result of parse_page for each page in dump order
+def parse_pages(pages, pool=None, workers=1, languages=LANGUAGES):
+	return map_batches(functools.partial(parse_page, languages=languages), pages, pool, workers, PAGE_BATCH_SIZE)
+
+#gets the (title, sha1) pair identifying the revision of a page,
+#or None if the page has no revision sha1
+def page_revision(lines):
+	title = None
+	sha1 = None
+	for line in lines:
+		if line.startswith('<title>'):
+			title = line.replace('<title>', '').replace('</title>', '')
+			break
+	for line in reversed(lines):
+		if line.startswith('<sha1>'):
+			sha1 = line.replace('<sha1>', '').replace('</sha1>', '')
+			break
+	if title is None or sha1 is None: return None
+	return title, sha1
+
+#version of the parser (a hash of this file), as results of different versions may differ
+def parser_version():
+	with open(os.path.abspath(__file__), 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+#on-disk cache of parse_page results, keyed by page title and revision sha1, so that
+#rebuilding from a newer dump only reparses the pages that changed since the last build.
+#cached results are only valid for the parser (and languages) that produced them, so the
+#cache is emptied whenever this file or the languages change.
+#a result is stored as parse_page returns it, i.e. with the quotations and examples of its
+#senses already cleaned by clean_page (not the raw ones), along with the counters (of dropped
+#glosses, examples etc.) its parse incremented, which are counted again when it is reused
+class PageCache:
+	def __init__(self, path, languages=LANGUAGES):
+		version = parser_version()+':'+','.join(languages)
+
+		#used by the parse stage's thread, but only by one thread at a time
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+		self.db.execute('CREATE TABLE IF NOT EXISTS pages (title TEXT PRIMARY KEY, sha1 TEXT, senses BLOB)')
+		row = self.db.execute('SELECT value FROM meta WHERE key = ?', ('parser',)).fetchone()
+		if row is None or row[0] != version:
+			self.db.execute('DELETE FROM pages')
+			self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('parser', version))
+		self.db.commit()
+		self.uncommitted = 0
+
+	#gets the cached result of parse_page for a page revision and the counters its parse
+	#incremented, as a (senses, counts) pair, or None if it isn't cached
+	def get(self, key):
+		title, sha1 = key
+		row = self.db.execute('SELECT sha1, senses FROM pages WHERE title = ?', (title,)).fetchone()
+		if row is None or row[0] != sha1:
+			instrumentation.count('cache_misses')
+			return None
+		instrumentation.count('cache_hits')
+		return pickle.loads(row[1])
+
+	#stores the result of parse_page for a page revision with the counters its parse incremented,
+	#replacing older revisions of the page
+	def put(self, key, senses, counts):
+		title, sha1 = key
+		data = pickle.dumps((senses, counts), protocol=pickle.HIGHEST_PROTOCOL)
+		self.db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)', (title, sha1, data))
+		self.uncommitted += 1
+		if self.uncommitted >= CACHE_COMMIT_SIZE:
+			self.db.commit()
+			self.uncommitted = 0
+
+	def close(self):
+		self.db.commit()
+		self.db.close()
+
+#runs parse_page on pages that were not found in the cache (given as None otherwise),
+#returning its result with the counters it incremented, to be cached together
+def process_uncached_page(lines, languages=LANGUAGES):
+	if lines is None: return None
+	with instrumentation.recorded_counts() as counts:
+		senses = parse_page(lines, languages)
+	return senses, dict(counts)
+
+#parses pages from the dump like parse_pages, but reuses cached results for pages whose
+#revision is unchanged and caches the results of the pages that had to be parsed. the
+#counters of a reused result are incremented again, so the counts are those of a full parse.
+#yields the result of each page with the counters incremented for it (including cache_hits
+#and cache_misses), like call_counted
+def parse_pages_cached(pages, cache, pool=None, workers=1, languages=LANGUAGES):
+	looked_up = collections.deque()
+	def lookups():
+		for page in pages:
+			#pages that could not be decoded are passed on as they are
+			if isinstance(page, PageError):
+				looked_up.append((None, (page, {}), collections.Counter()))
+				yield None
+				continue
+			key = page_revision(page)
+			cached = None
+			with instrumentation.recorded_counts() as lookup_counts:
+				if key is not None: cached = cache.get(key)
+			looked_up.append((key, cached, lookup_counts))
+			#cached pages are not sent to the parser
+			if cached is None: yield page
+			else: yield None
+
+	parse = functools.partial(process_uncached_page, languages=languages)
+	for s in map_batches(parse, lookups(), pool, workers, PAGE_BATCH_SIZE):
+		key, cached, lookup_counts = looked_up.popleft()
+		if cached is None:
+			senses, counts = s
+			#failed pages are not cached, so they are parsed again by later builds
+			if key is not None and not isinstance(senses, PageError): cache.put(key, senses, counts)
+		else:
+			senses, counts = cached
+			for name, n in counts.items():
+				instrumentation.count(name, n)
+		lookup_counts.update(counts)
+		yield senses, dict(lookup_counts)
+
+#reads the start offset of every bz2 stream from a multistream index file,
+#whose lines are formatted as offset:page_id:title
+def load_stream_offsets(index_path):
+	if index_path.endswith('.bz2'): f = bz2.open(index_path, 'rt', encoding='utf-8')
+	else: f = open(index_path, 'r', encoding='utf-8')
+	offsets = set()
+	for line in f:
+		offset = line.split(':', 1)[0]
+		if len(offset) > 0: offsets.add(int(offset))
 	f.close()
-	print(len(senses), '{:.2f}'.format(time.time()-start_time))
+	return sorted(offsets)
+
+#decompresses the bz2 stream(s) stored between the start and end byte offsets of a file
+def decompress_stream(block):
+	path, start, end = block
+	with open(path, 'rb') as f:
+		f.seek(start)
+		data = f.read(end-start)
+	return bz2.decompress(data)
+
+#yields the (bytes) lines of a multistream bz2 dump, using its index to split the file into
+#streams that are decompressed independently (in parallel when given a pool)
+def read_multistream(path, index_path, pool=None, workers=1, progress=None):
+	offsets = load_stream_offsets(index_path)
+	size = os.path.getsize(path)
+	#the first stream (before the first indexed page) holds the siteinfo header
+	bounds = [o for o in offsets if 0 < o < size]
+	bounds = [0]+bounds+[size]
+	blocks = [(path, bounds[i], bounds[i+1]) for i in range(len(bounds)-1)]
+
+	read = [0]
+	if progress is not None:
+		progress.total = size
+		progress.position = lambda: bounds[read[0]]
+	partial = b''
+	for data in map_batches(decompress_stream, blocks, pool, workers, STREAM_BATCH_SIZE):
+		read[0] += 1
+		lines = (partial+data).split(b'\n')
+		partial = lines.pop()
+		for line in lines:
+			yield line+b'\n'
+	if len(partial) > 0:
+		yield partial
+
+#yields the lines of a wiktionary dump file (as bytes, which read_pages decodes page by page),
+#either uncompressed xml or bz2;
+#bz2 dumps are decompressed in parallel when the multistream index is given.
+#if given, progress is told the size of the file and how to get how much of it was read
+def read_dump(path, index_path=None, pool=None, workers=1, progress=None):
+	if index_path is not None:
+		for line in read_multistream(path, index_path, pool, workers, progress):
+			yield line
+		return
+
+	raw = open(path, 'rb')
+	if progress is not None:
+		progress.total = os.path.getsize(path)
+		progress.position = raw.tell
+	if path.endswith('.bz2'): f = bz2.open(raw, 'rb')
+	else: f = raw
+	with f:
+		for line in f:
+			yield line
+
+#saves the state of a run at a checkpoint, replacing the previous one
+def save_checkpoint(filepath, state):
+	with open(filepath+'.tmp', 'wb') as f:
+		pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(filepath+'.tmp', filepath)
+
+#identifies the input of a run (the dump and the languages extracted from it), to check
+#that a checkpoint belongs to the run being resumed
+def checkpoint_input(args):
+	return [args.wiki_file, args.wiki_index, list(args.languages), file_stamps([args.wiki_file])]
+
+#loads the last checkpoint of an interrupted run, checking it was made by the same parser
+#on the same input, or returns None if there is none
+def load_checkpoint(filepath, args):
+	if not os.path.exists(filepath): return None
+	with open(filepath, 'rb') as f:
+		state = pickle.load(f)
+	if state['version'] != parser_version():
+		raise ValueError('checkpoint {} was made by a different version of the parser'.format(filepath))
+	if state['input'] != checkpoint_input(args):
+		raise ValueError('checkpoint {} was made on a different dump or languages'.format(filepath))
+	return state
+
+#subdirectory of the save dir to which the senses, quotations and examples of a language
+#are saved; those of English are saved in the save dir itself
+def language_dir(lang):
+	if lang == 'English': return ''
+	return lang.lower().replace(' ', '_')
 
-	#add post-processing to seperate out quotes, examples into seperate lists
-	senses, quotations, examples = post_processing(senses)
+#processes a given wiktionary dump file into a list of senses
+#and lists of quotations and examples with sense-disambiguated examples.
+#the work runs as a pipeline of stages, each in its own thread: reading (and decompressing)
+#the dump, parsing pages (in a pool of worker processes), post-processing pages in dump
+#order and writing out the results. only a bounded number of pages are held between
+#stages, so memory use depends on the size of a page rather than the dump.
+#pages that fail to parse are written to a quarantine file (as json lines) and skipped.
+#the run is checkpointed regularly (the position in the dump, sense id counters, counters
+#and timers of the pages before it and sizes of the flushed output files) so that it can be
+#resumed if interrupted.
+#the senses of each of args.languages are extracted in the same pass over the dump,
+#with their own sense id counters and output files
+def parse_dump(args, progress):
+	#uncompressed dumps are split into pages from a memory map; the workers are sent
+	#the byte offsets of pages (unless they need to be looked up in the cache first)
+	use_mmap = args.wiki_index is None and not args.wiki_file.endswith('.bz2') and not args.no_mmap
+	#position in the dump to resume from: a byte offset if it is read from a memory map,
+	#or else a number of pages (including those skipped by the prefilters)
+	position = 'offset' if use_mmap else 'pages'
+
+	languages = args.languages
+	#sense id counters for each word, pos pair seen so far, for each language
+	word_idxs = {lang: {} for lang in languages}
+	#counters of the pages post-processed so far, saved at checkpoints (the counters of the
+	#process also count pages that are still being read and parsed)
+	counts = collections.Counter()
+	totals = {'pages': 0, 'senses': 0, 'quotations': 0, 'examples': 0, 'page_errors': 0,
+		'languages': {lang: {'senses': 0, 'quotations': 0, 'examples': 0} for lang in languages}}
+	out_names = ['quarantine.jsonl']
+	for lang in languages:
+		out_names.extend(os.path.join(language_dir(lang), name) for name in ['senses.txt', 'examples.txt', 'quotations.txt'])
+		if not os.path.exists(os.path.join(args.save_dir, language_dir(lang))):
+			os.makedirs(os.path.join(args.save_dir, language_dir(lang)))
+	out_paths = {name: os.path.join(args.save_dir, name) for name in out_names}
+	checkpoint_path = os.path.join(args.save_dir, 'parse_checkpoint.pkl')
+	state = None
+	if args.resume:
+		state = load_checkpoint(checkpoint_path, args)
+		if state is None: print('no checkpoint to resume from, starting from the beginning')
+	if state is not None:
+		if state['position'][0] != position:
+			raise ValueError('checkpoint {} was made reading the dump in a different way'.format(checkpoint_path))
+		word_idxs = state['word_idxs']
+		totals = state['totals']
+		counts.update(state['counts'])
+		instrumentation.merge_stats((state['counts'], state['times']))
+		#drop what was written after the checkpoint
+		for name, path in out_paths.items():
+			os.truncate(path, state['outputs'][name])
+		print('resuming from checkpoint at {} {}'.format(state['position'][1], position))
+		start = state['position'][1]
+		mode = 'a'
+	else:
+		start = 0
+		mode = 'w'
+
+	#worker processes shared by decompression and parsing; they start without the counters
+	#and timers they were forked with (e.g. those restored from the checkpoint)
+	if args.workers > 1: pool = multiprocessing.Pool(args.workers, instrumentation.take_stats)
+	else: pool = None
+
+	#open output files for senses, examples and quotes of each language (and quarantined pages)
+	files = {name: open(path, mode) for name, path in out_paths.items()}
+	lang_files = {lang: [files[os.path.join(language_dir(lang), name)] for name in ['senses.txt', 'examples.txt', 'quotations.txt']]
+		for lang in languages}
+	err_f = files['quarantine.jsonl']
+
+	cache = None
+	if args.cache_file is not None: cache = PageCache(args.cache_file, languages)
+
+	#position in the dump after each page sent to be parsed, in order, with the counters
+	#incremented reading it and the pages skipped before it
+	positions = collections.deque()
+
+	#load wikitionary dump data file and scan through it, yielding pages
+	def read():
+		with instrumentation.recorded_counts() as read_counts:
+			if use_mmap:
+				for start_offset, end_offset in page_ranges(args.wiki_file, progress, start):
+					page_range = (args.wiki_file, start_offset, end_offset)
+					if cache is None: page = page_range
+					else:
+						page = read_page_range(page_range, languages=languages)
+						if page is None: continue
+					positions.append((end_offset, dict(read_counts)))
+					read_counts.clear()
+					yield page
+			else:
+				pages = split_pages(read_dump(args.wiki_file, args.wiki_index, pool, args.workers, progress))
+				for i, data in enumerate(pages):
+					#pages before the checkpoint are neither decoded nor counted again
+					if i < start: continue
+					page = read_page_bytes(data, languages=languages)
+					if page is None: continue
+					positions.append((i+1, dict(read_counts)))
+					read_counts.clear()
+					yield page
+
+	#process pages; results come back in dump order, so sense ids match a serial run
+	#regardless of the number of workers. each comes with the counters incremented for its page
+	def parse(pages):
+		if use_mmap and cache is None: func = functools.partial(parse_page_range, languages=languages)
+		elif cache is not None: return parse_pages_cached(pages, cache, pool, args.workers, languages)
+		else: func = functools.partial(parse_page, languages=languages)
+		return map_batches(functools.partial(call_counted, func), pages, pool, args.workers, PAGE_BATCH_SIZE)
+
+	#add post-processing to seperate out quotes, examples; a checkpoint is passed on to the
+	#writer every checkpoint interval, after the outputs of the pages before it
+	def post_process(results):
+		last_checkpoint = time.time()
+		for s, parse_counts in results:
+			pos, read_counts = positions.popleft()
+			counts.update(read_counts)
+			counts.update(parse_counts)
+			if s is not None: #else skipped by the prefilters
+				totals['pages'] += 1
+				progress.update()
+				if isinstance(s, PageError):
+					totals['page_errors'] += 1
+					yield 'error', s
+				elif s != -1:
+					page = {}
+					with instrumentation.timed('post_processing'):
+						for lang, senses in s.items():
+							page[lang] = post_process_page(senses, word_idxs[lang], cleaned=True)
+					for lang, (senses, quotations, examples) in page.items():
+						for name, x in [('senses', senses), ('quotations', quotations), ('examples', examples)]:
+							totals[name] += len(x)
+							totals['languages'][lang][name] += len(x)
+					yield 'page', page
+			if time.time()-last_checkpoint >= args.checkpoint_interval:
+				last_checkpoint = time.time()
+				yield 'checkpoint', {'position': (position, pos), 'word_idxs': copy.deepcopy(word_idxs), 'totals': copy.deepcopy(totals),
+					'counts': dict(counts), 'times': instrumentation.get_stats()[1]}
+
+	#save each
+	def write(results):
+		for kind, x in results:
+			with instrumentation.timed('save'):
+				if kind == 'page':
+					for lang, (senses, quotations, examples) in x.items():
+						s_f, e_f, q_f = lang_files[lang]
+						for sense in senses: write_sense(s_f, sense)
+						for ex in examples: write_example(e_f, ex)
+						for quote in quotations: write_quotation(q_f, quote)
+				elif kind == 'error':
+					print('failed to parse page {}: {}'.format(x.title, x.error))
+					err_f.write(x.to_json()+'\n')
+				else:
+					x['outputs'] = {}
+					for name, f in files.items():
+						f.flush()
+						os.fsync(f.fileno())
+						x['outputs'][name] = os.fstat(f.fileno()).st_size
+					x['version'] = parser_version()
+					x['input'] = checkpoint_input(args)
+					save_checkpoint(checkpoint_path, x)
+
+	pipeline = Pipeline([('read', lambda _: instrumentation.timed_iter(read(), 'read')), ('parse', parse),
+		('post_process', post_process), ('write', write)])
+	progress.status = pipeline.depths
+	try:
+		pipeline.run()
+	except BaseException:
+		if pool is not None: pool.terminate()
+		raise
+	totals['queues'] = pipeline.stats()
+	if pool is not None:
+		pool.close()
+		pool.join()
+	if cache is not None:
+		totals['cache_hits'] = instrumentation.COUNTS['cache_hits']
+		totals['cache_misses'] = instrumentation.COUNTS['cache_misses']
+		print('page cache: {} hits, {} misses'.format(totals['cache_hits'], totals['cache_misses']))
+		cache.close()
+	with instrumentation.timed('save'):
+		for f in files.values():
+			f.close()
+	#the run is complete, so there is nothing to resume
+	if os.path.exists(checkpoint_path): os.remove(checkpoint_path)
+
+	return totals
+
+#parses the dump (see parse_dump), reporting progress while doing so and saving a report
+#of the run (totals, time spent in each stage, counts of dropped items) next to the outputs
+def main(args):
+	start_time = time.time()
 
 	#make save dir if it doesn't exist
 	if not os.path.exists(args.save_dir):
 		os.makedirs(args.save_dir)
-
-	#save senses
-	s_path = os.path.join(args.save_dir, 'senses.txt')
-	save_senses(s_path, senses)
-
-	#save examples
-	e_path = os.path.join(args.save_dir, 'examples.txt')
-	save_examples(e_path, examples)
-
-	#save quotes
-	q_path = os.path.join(args.save_dir, 'quotations.txt')
-	save_quotations(q_path, quotations)
+	#each language is extracted once
+	args.languages = list(dict.fromkeys(args.languages))
+
+	progress = instrumentation.Progress()
+	prof_path = os.path.join(args.save_dir, 'parse_profile.prof')
+	totals, prof = instrumentation.profile(args.profile, prof_path, parse_dump, args, progress)
+	elapsed = time.time()-start_time
+	print(totals['senses'], '{:.2f}'.format(elapsed))
+
+	report = {'args': vars(args), 'elapsed_seconds': elapsed, 'totals': totals}
+	if prof is not None: report['profile'] = prof
+	instrumentation.save_report(os.path.join(args.save_dir, 'parse_report.json'), report)
 
 	return
 
@@ -0,0 +1,259 @@
+'''
+Copyright (c) Facebook, Inc. and its affiliates.
+All rights reserved.
+This source code is licensed under the license found in the
+LICENSE file in the root directory of this source tree.
+'''
+
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#INSTRUMENTATION for the dataset creation scripts: stage timers, counters,
+#progress reports and profiling
+
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import resource
+import signal
+import sys
+import threading
+import time
+
+#counters (e.g. of items dropped by the parser, and why) and seconds spent in each stage;
+#worker processes send theirs back with their results (see take_stats/merge_stats).
+#the threads of a process share them, under LOCK
+COUNTS = collections.Counter()
+TIMES = collections.Counter()
+LOCK = threading.Lock()
+LOCAL = threading.local() #counters being recorded by each thread (see recorded_counts)
+THREAD_PROFILES = None #cProfile profilers of the threads of a run profiled with cprofile (see thread_profile)
+
+REPORT_INTERVAL = 30 #seconds between progress reports
+SAMPLE_INTERVAL = 0.005 #seconds between samples of the sampling profiler
+
+#increments a counter
+def count(name, n=1):
+	with LOCK:
+		COUNTS[name] += n
+	for counts in getattr(LOCAL, 'recorders', ()):
+		counts[name] += n
+
+#records the counters incremented by this thread inside the with block (e.g. while
+#parsing one page) in the Counter it yields; they are still added to COUNTS as well
+@contextlib.contextmanager
+def recorded_counts():
+	counts = collections.Counter()
+	if not hasattr(LOCAL, 'recorders'): LOCAL.recorders = []
+	LOCAL.recorders.append(counts)
+	try:
+		yield counts
+	finally:
+		LOCAL.recorders.remove(counts)
+
+#adds seconds to the time spent in a stage
+def add_time(stage, seconds):
+	with LOCK:
+		TIMES[stage] += seconds
+
+#times the code run inside the with block as part of the given stage
+@contextlib.contextmanager
+def timed(stage):
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		add_time(stage, time.perf_counter()-start)
+
+#yields the items of an iterable, timing the time spent getting each one as part of stage
+def timed_iter(iterable, stage):
+	it = iter(iterable)
+	while True:
+		start = time.perf_counter()
+		try:
+			x = next(it)
+		except StopIteration:
+			add_time(stage, time.perf_counter()-start)
+			return
+		add_time(stage, time.perf_counter()-start)
+		yield x
+
+#gets and resets the counters and timers of this process
+def take_stats():
+	with LOCK:
+		stats = (dict(COUNTS), dict(TIMES))
+		COUNTS.clear()
+		TIMES.clear()
+	return stats
+
+#gets a copy of the counters and timers of this process (without resetting them)
+def get_stats():
+	with LOCK:
+		return dict(COUNTS), dict(TIMES)
+
+#adds counters and timers taken from another process (or a checkpoint) to this one's
+def merge_stats(stats):
+	counts, times = stats
+	with LOCK:
+		COUNTS.update(counts)
+		TIMES.update(times)
+
+#resident memory of this process in MB (peak resident memory where the current isn't available)
+def rss_mb():
+	try:
+		with open('/proc/self/statm', 'r') as f:
+			pages = int(f.read().split()[1])
+		return pages*os.sysconf('SC_PAGE_SIZE')/2**20
+	except (OSError, ValueError, IndexError):
+		return max_rss_mb()
+
+#peak resident memory of this process in MB
+def max_rss_mb():
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin': return rss/2**20 #bytes on mac, kB elsewhere
+	return rss/2**10
+
+#tracks how far through the input a run is; the reader sets total to the input size
+#in bytes and position to a function returning the number of bytes consumed so far.
+#status can be set to a function returning more to add to each report (e.g. queue depths)
+class Progress:
+	def __init__(self, interval=REPORT_INTERVAL, out=sys.stderr):
+		self.interval = interval
+		self.out = out
+		self.total = None
+		self.position = None
+		self.status = None
+		self.items = 0
+		self.start = time.time()
+		self.last_report = self.start
+
+	#records that n more items (pages) were processed, reporting progress if it is time to
+	def update(self, n=1):
+		self.items += n
+		now = time.time()
+		if now-self.last_report >= self.interval:
+			self.last_report = now
+			self.report(now)
+
+	def report(self, now=None):
+		if now is None: now = time.time()
+		elapsed = now-self.start
+		msg = '[{:.0f}s] {} pages ({:.1f} pages/s)'.format(elapsed, self.items, self.items/max(elapsed, 1e-9))
+		if self.total and self.position is not None:
+			pos = self.position()
+			frac = pos/self.total
+			msg += ' | {:.0f}/{:.0f} MB ({:.1%})'.format(pos/2**20, self.total/2**20, frac)
+			if frac > 0:
+				eta = elapsed*(1-frac)/frac
+				msg += ' | ETA {:d}:{:02d}:{:02d}'.format(int(eta//3600), int(eta%3600//60), int(eta%60))
+		msg += ' | RSS {:.0f} MB'.format(rss_mb())
+		if self.status is not None: msg += ' | '+self.status()
+		print(msg, file=self.out, flush=True)
+
+#statistical profiler that samples the stacks of all threads on a cpu timer (unix only);
+#stacks are rooted at the name of their thread
+class SamplingProfiler:
+	def __init__(self, interval=SAMPLE_INTERVAL):
+		self.interval = interval
+		self.stacks = collections.Counter()
+		self.functions = collections.Counter()
+
+	def sample(self, signum, interrupted):
+		names = {t.ident: t.name for t in threading.enumerate()}
+		for ident, frame in sys._current_frames().items():
+			#the signal handler runs in the main thread, in place of the interrupted frame
+			if ident == threading.get_ident(): frame = interrupted
+			stack = []
+			while frame is not None:
+				code = frame.f_code
+				stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+				frame = frame.f_back
+			if len(stack) == 0: continue
+			stack.append(names.get(ident, str(ident)))
+			self.functions[stack[0]] += 1
+			self.stacks[';'.join(reversed(stack))] += 1
+
+	def start(self):
+		signal.signal(signal.SIGPROF, self.sample)
+		signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+	def stop(self):
+		signal.setitimer(signal.ITIMER_PROF, 0, 0)
+		signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+	#most sampled functions (innermost frame) and stacks
+	def summary(self, top=30):
+		return {'interval': self.interval,
+			'samples': sum(self.functions.values()),
+			'functions': self.functions.most_common(top),
+			'stacks': self.stacks.most_common(top)}
+
+#profiles the code run inside the with block (e.g. a stage of a pipeline) in this thread while
+#a run is profiled with cprofile, whose profiler only sees the thread that started it; the
+#profile is merged into the run's by profile()
+@contextlib.contextmanager
+def thread_profile():
+	profiles = THREAD_PROFILES
+	prof = None
+	if profiles is not None:
+		prof = cProfile.Profile()
+		try:
+			prof.enable()
+		except ValueError: #a profiler already sees all threads (python 3.12+)
+			prof = None
+	try:
+		yield
+	finally:
+		if prof is not None:
+			prof.disable()
+			with LOCK:
+				profiles.append(prof)
+
+#runs func(*args) under the requested profiler ('cprofile' or 'sample', or None for no profiling),
+#returning its result and a summary of the profile for the report. cProfile stats (of the
+#calling thread and of the threads run in thread_profile) are also dumped to prof_path,
+#for use with pstats or snakeviz
+def profile(mode, prof_path, func, *args):
+	global THREAD_PROFILES
+	if mode is None:
+		return func(*args), None
+	elif mode == 'cprofile':
+		THREAD_PROFILES = []
+		prof = cProfile.Profile()
+		try:
+			result = prof.runcall(func, *args)
+		finally:
+			profiles = THREAD_PROFILES
+			THREAD_PROFILES = None
+		stats = pstats.Stats(prof)
+		for p in profiles:
+			stats.add(p)
+		stats.dump_stats(prof_path)
+		return result, {'mode': mode, 'path': prof_path, 'threads': len(profiles)+1}
+	elif mode == 'sample':
+		sampler = SamplingProfiler()
+		sampler.start()
+		try:
+			result = func(*args)
+		finally:
+			sampler.stop()
+		summary = sampler.summary()
+		summary['mode'] = mode
+		return result, summary
+	else:
+		raise ValueError('unknown profiler: {}'.format(mode))
+
+#writes a json report of a run, with the counters and stage timers collected so far
+def save_report(filepath, report):
+	report = dict(report)
+	report['stage_seconds'] = dict(sorted(TIMES.items()))
+	report['counts'] = dict(sorted(COUNTS.items()))
+	report['max_rss_mb'] = max_rss_mb()
+	with open(filepath, 'w') as f:
+		json.dump(report, f, indent=1)
+		f.write('\n')
+	return
+
+#EOF
@@ -0,0 +1,204 @@
+'''
+Copyright (c) Facebook, Inc. and its affiliates.
+All rights reserved.
+This source code is licensed under the license found in the
+LICENSE file in the root directory of this source tree.
+'''
+
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from utils import *
+
+'''
+This script scores predicted sense ids against the gold labels of FEWS eval splits,
+with accuracy broken down by split, part-of-speech, sense depth and training support,
+and bootstrap confidence intervals.
+'''
+
+parser = argparse.ArgumentParser(description='Score WSD predictions on FEWS')
+parser.add_argument('--senses', type=str, required=True,
+	help='Filepath to senses.txt')
+parser.add_argument('--gold', type=str, nargs='+', required=True,
+	help='Filepaths of the eval splits to score (e.g. dev.few-shot.txt dev.zero-shot.txt)')
+parser.add_argument('--predictions', type=str, nargs='+', required=True,
+	help='Filepaths of the predictions for each gold file, in the same order: one line per example, with the predicted sense id as its last tab-separated field')
+parser.add_argument('--train-files', type=str, nargs='*', default=[],
+	help='Filepaths of the training data (e.g. train.ext.txt, which already holds the rows of train.txt) whose label counts give the support of each sense')
+parser.add_argument('--bootstrap', type=int, default=1000,
+	help='Number of bootstrap samples for the confidence intervals (0 to skip them)')
+parser.add_argument('--seed', type=int, default=0,
+	help='Random seed of the bootstrap')
+parser.add_argument('--output', type=str, default=None,
+	help='Filepath at which to save the scores as json')
+
+CONFIDENCE = 0.95 #level of the bootstrap confidence intervals
+#lower bounds of the training support buckets (number of training examples of the gold sense)
+SUPPORT_BUCKETS = [0, 1, 2, 5, 10, 50]
+
+#names of the support buckets, e.g. 2-4 and 50+
+def support_bucket_names():
+	names = []
+	for i, lo in enumerate(SUPPORT_BUCKETS):
+		if i+1 == len(SUPPORT_BUCKETS): names.append('{}+'.format(lo))
+		elif SUPPORT_BUCKETS[i+1]-lo == 1: names.append(str(lo))
+		else: names.append('{}-{}'.format(lo, SUPPORT_BUCKETS[i+1]-1))
+	return names
+
+#integer codes of strings (in order of first appearance) and the strings of the codes
+def encode(values):
+	codes = {}
+	out = np.fromiter((codes.setdefault(v, len(codes)) for v in values), dtype=np.int32)
+	return out, list(codes)
+
+#sense inventory coded for scoring: the integer id of each sense (its index in the sense
+#index), and the part-of-speech and depth of each id
+class Inventory:
+	def __init__(self, senses, sense_index=None):
+		if sense_index is None: sense_index = build_sense_index(senses)
+		self.sense_index = sense_index
+		self.pos, self.pos_names = encode(s.rsplit('.', 2)[1] for s in sense_index.sense_ids)
+		self.depth = np.fromiter((int(senses[s]['depth']) for s in sense_index.sense_ids), dtype=np.int32,
+			count=len(sense_index))
+
+	def __len__(self):
+		return len(self.sense_index)
+
+	#integer ids of a list of sense ids (-1 for those not in the inventory); each distinct
+	#sense id is looked up in the sense index once
+	def ids(self, labels):
+		ids = self.sense_index.ids
+		found = {}
+		def lookup(l):
+			i = found.get(l)
+			if i is None: i = found[l] = ids.get(l, -1)
+			return i
+		return np.fromiter((lookup(l) for l in labels), dtype=np.int32)
+
+	#number of training examples of each sense, from the labels of the distinct (sentence, label)
+	#rows of the given data files, so a row in several of them (e.g. train.txt and train.ext.txt,
+	#which holds the rows of train.txt) is counted once
+	def support(self, train_paths):
+		rows = set()
+		for path in train_paths:
+			rows.update((row[0], row[1]) for row in read_shard(path, 0, 1))
+		labels = self.ids(label for _, label in rows)
+		return np.bincount(labels[labels >= 0], minlength=len(self)).astype(np.int64)
+
+#gold labels of one or more eval splits as integer ids, with the split of each example and
+#the part-of-speech, depth and training support bucket of its label
+class Gold:
+	def __init__(self, inventory, gold_paths, train_paths=()):
+		self.inventory = inventory
+		self.split_names = []
+		labels = []
+		splits = []
+		for i, path in enumerate(gold_paths):
+			name = os.path.basename(path)
+			if name.endswith('.txt'): name = name[:-4]
+			self.split_names.append(name)
+			l = inventory.ids(row[1] for row in read_shard(path, 0, 1))
+			labels.append(l)
+			splits.append(np.full(len(l), i, dtype=np.int32))
+		self.labels = np.concatenate(labels) if len(labels) > 0 else np.zeros(0, dtype=np.int32)
+		self.splits = np.concatenate(splits) if len(splits) > 0 else np.zeros(0, dtype=np.int32)
+		self.sizes = [len(l) for l in labels]
+
+		#labels missing from the inventory are counted as wrong, in no pos, depth or support group
+		known = self.labels >= 0
+		self.pos = np.where(known, inventory.pos[self.labels], -1)
+		self.depth = np.where(known, inventory.depth[self.labels], -1)
+		self.support_names = support_bucket_names()
+		if len(train_paths) > 0:
+			support = inventory.support(train_paths)
+			bucket = np.searchsorted(SUPPORT_BUCKETS, support[self.labels], side='right')-1
+			self.support = np.where(known, bucket, -1)
+		else:
+			self.support = None
+
+	def __len__(self):
+		return len(self.labels)
+
+#reads the predicted sense ids of a predictions file (the last tab-separated field of each line)
+def load_predictions(filepath):
+	with open(filepath, 'r') as f:
+		return [line.rstrip('\n').rsplit('\t', 1)[-1] for line in f]
+
+#accuracy of each group (code) of examples with a (percentile bootstrap) confidence interval;
+#the correct count of a resample of n examples is binomial, so each group is resampled in one draw
+def group_scores(correct, groups, names, bootstrap, rng):
+	valid = groups >= 0
+	n = np.bincount(groups[valid], minlength=len(names))
+	c = np.bincount(groups[valid], weights=correct[valid], minlength=len(names))
+	acc = np.divide(c, n, out=np.zeros(len(names)), where=n > 0)
+	scores = {}
+	if bootstrap > 0:
+		samples = rng.binomial(n[:, None], acc[:, None], size=(len(names), bootstrap))/np.maximum(n, 1)[:, None]
+		alpha = (1-CONFIDENCE)/2
+		lo, hi = np.quantile(samples, [alpha, 1-alpha], axis=1)
+	for g, name in enumerate(names):
+		if n[g] == 0: continue
+		scores[str(name)] = {'accuracy': float(acc[g]), 'n': int(n[g])}
+		if bootstrap > 0: scores[str(name)]['ci'] = [float(lo[g]), float(hi[g])]
+	return scores
+
+#scores predictions (sense ids, or integer ids from inventory.ids) against gold labels: accuracy
+#overall and by split, pos, depth and training support bucket (if the gold has support)
+def score(gold, predictions, bootstrap=1000, seed=0):
+	if not isinstance(predictions, np.ndarray): predictions = gold.inventory.ids(predictions)
+	if len(predictions) != len(gold):
+		raise ValueError('{} predictions for {} gold examples'.format(len(predictions), len(gold)))
+	correct = (predictions == gold.labels) & (gold.labels >= 0)
+	rng = np.random.default_rng(seed)
+
+	scores = {'all': group_scores(correct, np.zeros(len(gold), dtype=np.int32), ['all'], bootstrap, rng)['all']}
+	scores['split'] = group_scores(correct, gold.splits, gold.split_names, bootstrap, rng)
+	scores['pos'] = group_scores(correct, gold.pos, gold.inventory.pos_names, bootstrap, rng)
+	max_depth = int(gold.depth.max()) if len(gold) > 0 else 0
+	scores['depth'] = group_scores(correct, gold.depth, list(range(max_depth+1)), bootstrap, rng)
+	if gold.support is not None:
+		scores['support'] = group_scores(correct, gold.support, gold.support_names, bootstrap, rng)
+	return scores
+
+#prints scores as a table, one line per group
+def print_scores(scores):
+	def line(name, s):
+		ci = ' [{:.2%}, {:.2%}]'.format(*s['ci']) if 'ci' in s else ''
+		print('{:<24} {:>8.2%}{} (n={})'.format(name, s['accuracy'], ci, s['n']))
+	line('all', scores['all'])
+	for breakdown in ['split', 'pos', 'depth', 'support']:
+		if breakdown not in scores: continue
+		for name, s in scores[breakdown].items():
+			line('{}={}'.format(breakdown, name), s)
+
+def main(args):
+	if len(args.gold) != len(args.predictions):
+		raise ValueError('each gold file needs a predictions file')
+	senses = load_senses(args.senses)
+	inventory = Inventory(senses)
+	gold = Gold(inventory, args.gold, args.train_files)
+
+	predictions = []
+	for path, size in zip(args.predictions, gold.sizes):
+		p = load_predictions(path)
+		if len(p) != size: raise ValueError('{} has {} predictions for {} gold examples'.format(path, len(p), size))
+		predictions.extend(p)
+	scores = score(gold, predictions, args.bootstrap, args.seed)
+	print_scores(scores)
+
+	if args.output is not None:
+		with open(args.output, 'w') as f:
+			json.dump(scores, f, indent=1)
+			f.write('\n')
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	main(args)
+
+#EOF
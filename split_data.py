@@ -9,8 +9,13 @@ LICENSE file in the root directory of this source tree.
 # -*- coding: utf-8 -*-
 
 import argparse
+import collections
+import hashlib
+import multiprocessing
 import os
 import random
+import shutil
+import tempfile
 #set random seed to data splitting will be deterministic 
 #(assuming same wiktionary dump files)
 random.seed(42)
@@ -22,6 +27,18 @@ parser.add_argument('--raw-dir', type=str, required=True,
 	help='Filepath to the extracted Wiktionary data')
 parser.add_argument('--save-dir', type=str, required=True,
 	help='Filepath at which to save split data')
+parser.add_argument('--rebuild-index', action='store_true',
+	help='Rebuild the sense index saved in the raw dir even if it is up to date')
+parser.add_argument('--binary', action='store_true',
+	help='Also save each split (and senses) in the binary format read by load_examples_binary/load_senses_binary')
+parser.add_argument('--spans', action='store_true',
+	help='Also save each split as a .spans.txt file, with the sentences without <WSD> markers and the character offsets of the marked mentions')
+parser.add_argument('--hash-split', action='store_true',
+	help='Stream the data and assign rows to splits by a keyed hash, instead of shuffling it in memory')
+parser.add_argument('--hash-key', type=str, default='fews',
+	help='Key of the hash used by --hash-split (a different key gives a different split)')
+parser.add_argument('--workers', type=int, default=1,
+	help='Number of processes used by --hash-split, or to write the split files in parallel')
 
 #sizes of zero shot and few shot eval data
 #(later split between dev and test)
@@ -31,28 +48,26 @@ FEW_SIZE = 10000
 
 USE_POS = True
 
+#filter out senses with these tags from dev/test sets
+IGNORED_TAGS = set(['obsolete', 'rare', 'archaic', 'dated', 'nonstandard', 'vulgar']) #historical?
+
+HASH_SHARDS_PER_WORKER = 4 #byte-range shards of each data file per --hash-split worker
+
 def clean_eval_sent(sent):
 	ex_idx = sent.find('</WSD>')+6 #point to end of first example
 	sent = sent[:ex_idx]+sent[ex_idx:].replace('<WSD>', '').replace('</WSD>', '')
 	return sent
 	
 #splits data into/train/dev/test
-def split_data(data, senses):
+def split_data(data, senses, sense_index):
 	#size of dataset before splitting
 	print(len(data))
 
-	#filter out these words from dev/test sets
-	ignored_tags = set(['obsolete', 'rare', 'archaic', 'dated', 'nonstandard', 'vulgar']) #historical?
-
 	random.shuffle(data)
 
-	#get label support for data
-	label_support = {}
-	for _, l, _ in data:
-		if l in label_support:
-			label_support[l] += 1
-		else:
-			label_support[l] = 1
+	#label support for data (all quotations of a label are kept by filter_monosemous_data)
+	label_support = sense_index.quotation_support
+	label_ids = sense_index.ids
 	
 	train_split = []
 	zero_split = []
@@ -66,14 +81,15 @@ def split_data(data, senses):
 		
 		#if not ignored tags...
 		key = get_key(label, use_pos=USE_POS)
-		if set(sense_tags).isdisjoint(ignored_tags) and label not in test_labels:
+		if set(sense_tags).isdisjoint(IGNORED_TAGS) and label not in test_labels:
 			#put into zero shot or few shot test sets if not full
 			#note: only including polysemous words (word+pos) in eval sets
-			if label_support[label] == 1 and len(zero_split) < ZERO_SIZE:
+			support = label_support[label_ids[label]]
+			if support == 1 and len(zero_split) < ZERO_SIZE:
 				sent = clean_eval_sent(sent) #so there is only one labeled example per eval sent
 				zero_split.append((sent, label, attrib))
 				test_labels.add(label)
-			elif label_support[label] > 1 and len(few_split) < FEW_SIZE:
+			elif support > 1 and len(few_split) < FEW_SIZE:
 				sent = clean_eval_sent(sent) #so there is only one labeled example per eval sent
 				few_split.append((sent, label, attrib))
 				test_labels.add(label)
@@ -92,20 +108,12 @@ def split_data(data, senses):
 	print(len(train_split), len(fs_dev_split), len(zs_dev_split), len(fs_test_split), len(zs_test_split))
 	return train_split, fs_dev_split, zs_dev_split, fs_test_split, zs_test_split
 
-def filter_monosemous_data(data, senses):
-	#build sense inventory
-	sense_inv = {}
-	for label in senses:
-		key = get_key(label, use_pos=USE_POS)
-		if key in sense_inv: sense_inv[key] += 1
-		else: sense_inv[key] = 1
-
+def filter_monosemous_data(data, sense_index):
 	#filter out monosemous examples (examples with one sense)
 	polysemous = []
 	monosemous = []
 	for d in data:
-		key = get_key(d[1], use_pos=USE_POS)
-		if sense_inv[key] > 1:
+		if sense_index.num_senses(d[1]) > 1:
 			polysemous.append(d)
 		else:
 			monosemous.append(d)
@@ -123,51 +131,221 @@ def filter_senses(data, filters):
 
 	return filtered_data
 
+#loads the sense index saved next to senses.txt, building (and saving) it
+#if it is missing or out of date with the parsed wiktionary data
+def get_sense_index(index_path, data_paths, senses, quotes, examples, rebuild=False):
+	stamps = file_stamps(data_paths)
+	if not rebuild and os.path.exists(index_path):
+		index = load_sense_index(index_path)
+		#indexes saved before the hash buckets were added are rebuilt too
+		if index.source == stamps and index.use_pos == USE_POS and index.by_hash is not None: return index
+	index = build_sense_index(senses, quotes, examples, use_pos=USE_POS, source=stamps)
+	save_sense_index(index_path, index)
+	return index
+
+#saves a split to txt file, and to binary and .spans.txt files next to it if requested
+def save_split(filepath, data, binary, spans):
+	save_examples(filepath, data)
+	if binary: save_examples_binary(filepath[:-4]+'.bin', data)
+	if spans: save_examples_spans(filepath[:-4]+'.spans.txt', data)
+
+#saves splits (a list of filepath, data pairs), up to workers at a time in parallel processes;
+#the processes are forked, so they share the data with this one rather than being sent it
+def save_splits(splits, binary, spans, workers=1):
+	if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+		for filepath, data in splits:
+			save_split(filepath, data, binary, spans)
+		return
+	ctx = multiprocessing.get_context('fork')
+	running = []
+	failed = []
+	def join(p):
+		p.join()
+		if p.exitcode != 0: failed.append(p.name)
+	for filepath, data in splits:
+		if len(running) >= workers: join(running.pop(0))
+		p = ctx.Process(target=save_split, args=(filepath, data, binary, spans), name=filepath)
+		p.start()
+		running.append(p)
+	for p in running: join(p)
+	if len(failed) > 0: raise RuntimeError('failed to save {}'.format(', '.join(failed)))
+
+'''
+Hash-based splitting (--hash-split): quotations.txt and examples.txt are streamed in
+byte-range shards (in parallel with --workers) instead of being loaded and shuffled, and
+the split of each row only depends on a keyed hash of its label and sentence, so it does
+not change with the order of the parsed data.
+Pass 1 finds the eval candidates: for each polysemous label without ignored tags, its
+quotation with the smallest hash. The ZERO_SIZE labels with one quotation and the FEW_SIZE
+labels with more, with the smallest hashes, go to the zero-shot and few-shot eval sets
+(the first half of each, by hash, to dev). Pass 2 writes every row to its split.
+'''
+
+#keyed hash of a data row
+def row_hash(sent, label, key):
+	h = hashlib.blake2b((label+'\t'+sent).encode('utf-8'), digest_size=8, key=key)
+	return int.from_bytes(h.digest(), 'big')
+
+#checks if a sense has any tags filtered out of dev/test sets
+def has_ignored_tags(sense):
+	return not set(sense['tags'].split(', ')).isdisjoint(IGNORED_TAGS)
+
+HASH_STATE = {} #state of the --hash-split workers in each process
+
+def init_hash_split(state):
+	HASH_STATE.clear()
+	HASH_STATE.update(state)
+	if 'index_path' in state: HASH_STATE['sense_index'] = load_sense_index(state['index_path'])
+
+#pass 1: the smallest (hash, byte offset) of the rows of each eval candidate in a shard
+def hash_split_candidates(task):
+	filepath, shard, num_shards = task
+	eligible = HASH_STATE['eligible']
+	key = HASH_STATE['key']
+	candidates = {}
+	for offset, (sent, label, *_) in read_shard(filepath, shard, num_shards, offsets=True):
+		if label not in eligible: continue
+		h = (row_hash(sent, label, key), offset)
+		if label not in candidates or h < candidates[label]: candidates[label] = h
+	return candidates
+
+#pass 2: writes the rows of a shard of quotations.txt or examples.txt to part files of each split
+def hash_split_write(task):
+	filepath, shard, num_shards, part_dir, kind = task
+	selected = HASH_STATE['selected']
+	zero_labels = HASH_STATE['zero_labels']
+	sense_index = HASH_STATE['sense_index']
+	key = HASH_STATE['key']
+
+	files = {}
+	counts = collections.Counter()
+	for offset, (sent, label, *_) in read_shard(filepath, shard, num_shards, offsets=True):
+		if sense_index.num_senses(label) == 1: split = 'monosemous'
+		elif kind == 'examples':
+			if label in zero_labels: continue
+			split = 'ext'
+		elif label in selected and selected[label][1] == (row_hash(sent, label, key), offset):
+			split = selected[label][0]
+			sent = clean_eval_sent(sent) #so there is only one labeled example per eval sent
+		else: split = 'train'
+
+		if split not in files:
+			files[split] = open(os.path.join(part_dir, '{}.{}.{:05d}.txt'.format(kind, split, shard)), 'w')
+		write_example(files[split], (sent, label))
+		counts[split] += 1
+	for f in files.values(): f.close()
+	return counts
+
+#runs func on each task, in a pool of workers (with their state set by init_hash_split)
+def run_hash_tasks(func, tasks, state, workers):
+	if workers > 1:
+		with multiprocessing.Pool(workers, init_hash_split, (state,)) as pool:
+			return pool.map(func, tasks)
+	init_hash_split(state)
+	return [func(task) for task in tasks]
+
+#concatenates the part files of a split (those that exist) into filepath
+def concat_parts(filepath, part_paths):
+	with open(filepath, 'wb') as out:
+		for path in part_paths:
+			if not os.path.exists(path): continue
+			with open(path, 'rb') as f:
+				shutil.copyfileobj(f, out)
+
+def hash_split_main(args, s_path, q_path, ex_path, index_path):
+	key = args.hash_key.encode('utf-8')
+	workers = max(args.workers, 1)
+	num_shards = workers*HASH_SHARDS_PER_WORKER
+	senses = load_senses_lazy(s_path)
+	sense_index = get_sense_index(index_path, [s_path, q_path, ex_path], senses,
+		read_shard(q_path, 0, 1), read_shard(ex_path, 0, 1), args.rebuild_index)
+
+	#pass 1: find the eval candidate of each polysemous label without ignored tags
+	eligible = set(l for l in senses if sense_index.num_senses(l) > 1 and not has_ignored_tags(senses[l]))
+	tasks = [(q_path, i, num_shards) for i in range(num_shards)]
+	candidates = {}
+	for shard_candidates in run_hash_tasks(hash_split_candidates, tasks, {'eligible': eligible, 'key': key}, workers):
+		for label, h in shard_candidates.items():
+			if label not in candidates or h < candidates[label]: candidates[label] = h
+
+	#fill the zero-shot and few-shot eval sets with the candidates with the smallest hashes
+	zero = sorted((h, l) for l, h in candidates.items() if sense_index.support(l) == 1)[:ZERO_SIZE]
+	few = sorted((h, l) for l, h in candidates.items() if sense_index.support(l) > 1)[:FEW_SIZE]
+	selected = {}
+	for i, (h, label) in enumerate(zero):
+		selected[label] = ('dev.zero-shot' if i < ZERO_SIZE//2 else 'test.zero-shot', h)
+	for i, (h, label) in enumerate(few):
+		selected[label] = ('dev.few-shot' if i < FEW_SIZE//2 else 'test.few-shot', h)
+
+	#pass 2: write each row to its split
+	state = {'selected': selected, 'zero_labels': set(l for _, l in zero), 'index_path': index_path, 'key': key}
+	with tempfile.TemporaryDirectory(dir=args.save_dir) as part_dir:
+		tasks = [(path, i, num_shards, part_dir, kind) for path, kind in [(q_path, 'quotations'), (ex_path, 'examples')]
+			for i in range(num_shards)]
+		counts = collections.Counter()
+		for shard_counts in run_hash_tasks(hash_split_write, tasks, state, workers):
+			counts.update(shard_counts)
+		def parts(kind, split):
+			return [os.path.join(part_dir, '{}.{}.{:05d}.txt'.format(kind, split, i)) for i in range(num_shards)]
+
+		paths = {split: os.path.join(args.save_dir, split+'.txt') for split in
+			['train', 'dev.few-shot', 'dev.zero-shot', 'test.few-shot', 'test.zero-shot']}
+		for split, path in paths.items():
+			concat_parts(path, parts('quotations', split))
+		paths['train.ext'] = os.path.join(args.save_dir, 'train.ext.txt')
+		concat_parts(paths['train.ext'], parts('quotations', 'train')+parts('examples', 'ext'))
+		paths['monosemous'] = os.path.join(args.save_dir, 'monosemous.txt')
+		concat_parts(paths['monosemous'], parts('quotations', 'monosemous')+parts('examples', 'monosemous'))
+
+	print(counts['train'], counts['dev.few-shot'], counts['dev.zero-shot'], counts['test.few-shot'], counts['test.zero-shot'])
+	if args.spans:
+		for path in paths.values():
+			save_examples_spans(path[:-4]+'.spans.txt', read_shard(path, 0, 1))
+	if args.binary:
+		for path in paths.values():
+			convert_to_binary(path, 'examples')
+		save_senses_binary(os.path.join(args.save_dir, 'senses.bin'), list(senses.values()))
+
 def main(args):
-	#load parsed wiktionary data
 	q_path = os.path.join(args.raw_dir, 'quotations.txt')
-	quotes = load_quotations(q_path)
 	s_path = os.path.join(args.raw_dir, 'senses.txt')
-	senses = load_senses(s_path)
 	ex_path = os.path.join(args.raw_dir, 'examples.txt')
+	index_path = os.path.join(args.raw_dir, 'sense_index.bin')
+	if args.hash_split:
+		hash_split_main(args, s_path, q_path, ex_path, index_path)
+		return
+
+	#load parsed wiktionary data
+	quotes = load_quotations(q_path)
+	senses = load_senses(s_path)
 	examples = load_examples(ex_path)
+	sense_index = get_sense_index(index_path, [s_path, q_path, ex_path], senses, quotes, examples, args.rebuild_index)
 
 	#split quotes into train/dev/test
-	data, monosemous_data = filter_monosemous_data(quotes, senses)
-	train, fs_dev, zs_dev, fs_test, zs_test = split_data(data, senses)
-
-	#save train data
-	train_path = os.path.join(args.save_dir, 'train.txt')
-	save_examples(train_path, train)
+	data, monosemous_data = filter_monosemous_data(quotes, sense_index)
+	train, fs_dev, zs_dev, fs_test, zs_test = split_data(data, senses, sense_index)
 
-	#create and save train extended 
+	#create train extended 
 	#(adds examples as extra train data)
 	random.shuffle(examples)
 	#filter monosymous senses from examples
-	ext, monosemous_ext = filter_monosemous_data(examples, senses)
+	ext, monosemous_ext = filter_monosemous_data(examples, sense_index)
 	#filter senses in zero-shot splits from examples
 	zero_shot_examples = zs_dev+zs_test
 	ext = filter_senses(ext, zero_shot_examples) 
 	ext = train+ext
-	ext_path = os.path.join(args.save_dir, 'train.ext.txt')
-	save_examples(ext_path, ext)
-
-	#save dev data
-	fs_dev_path = os.path.join(args.save_dir, 'dev.few-shot.txt')
-	save_examples(fs_dev_path, fs_dev)
-	zs_dev_path = os.path.join(args.save_dir, 'dev.zero-shot.txt')
-	save_examples(zs_dev_path, zs_dev)
-
-	#save test data
-	fs_test_path = os.path.join(args.save_dir, 'test.few-shot.txt')
-	save_examples(fs_test_path, fs_test)
-	zs_test_path = os.path.join(args.save_dir, 'test.zero-shot.txt')
-	save_examples(zs_test_path, zs_test)
-
-	#save monosemous examples as extra data
-	mono_path = os.path.join(args.save_dir, 'monosemous.txt')
-	mono_examples = monosemous_data+monosemous_ext
-	save_examples(mono_path, mono_examples)
+
+	#save train, dev and test data, and monosemous examples as extra data;
+	#these files are independent, so they can be written in parallel
+	splits = [('train.txt', train), ('train.ext.txt', ext),
+		('dev.few-shot.txt', fs_dev), ('dev.zero-shot.txt', zs_dev),
+		('test.few-shot.txt', fs_test), ('test.zero-shot.txt', zs_test),
+		('monosemous.txt', monosemous_data+monosemous_ext)]
+	save_splits([(os.path.join(args.save_dir, name), data) for name, data in splits], args.binary, args.spans, args.workers)
+
+	#save senses
+	if args.binary:
+		save_senses_binary(os.path.join(args.save_dir, 'senses.bin'), senses)
 
 if __name__ == "__main__":
 	args = parser.parse_args()
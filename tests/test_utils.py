@@ -0,0 +1,123 @@
+'''
+Copyright (c) Facebook, Inc. and its affiliates.
+All rights reserved.
+This source code is licensed under the license found in the
+LICENSE file in the root directory of this source tree.
+'''
+
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import *
+
+class StreamingExamplesTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name, 'train.txt')
+		save_examples(self.path, [('a <WSD>word</WSD> {}'.format(i), 'word.noun.{}'.format(i%3)) for i in range(689)])
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	#runs func in a thread, failing if it doesn't return within timeout seconds
+	def assertReturns(self, func, timeout=5):
+		thread = threading.Thread(target=func, daemon=True)
+		thread.start()
+		thread.join(timeout)
+		self.assertFalse(thread.is_alive(), 'iteration did not stop')
+
+	def test_all_rows(self):
+		rows = [row for batch in StreamingExamples(self.path, 300) for row in batch]
+		self.assertEqual(rows, load_examples(self.path))
+
+	#stopping once the reader has filled the queue (and is waiting to put its last item)
+	def test_break_early(self):
+		def run():
+			for batch in StreamingExamples(self.path, 300, prefetch=2):
+				time.sleep(0.5)
+				break
+		self.assertReturns(run)
+
+	def test_close_early(self):
+		def run():
+			it = iter(StreamingExamples(self.path, 300, prefetch=2))
+			next(it)
+			time.sleep(0.5)
+			it.close()
+		self.assertReturns(run)
+
+	#stopping while the reader is waiting to put an error
+	def test_break_before_error(self):
+		examples = StreamingExamples([self.path, os.path.join(self.tmp.name, 'missing.txt')], 300, prefetch=1)
+		def run():
+			for batch in examples:
+				time.sleep(0.5)
+				break
+		self.assertReturns(run)
+
+class SensesBinaryTest(unittest.TestCase):
+	#the parser gives tags and synonyms as tuples
+	def test_tuple_fields(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			path = os.path.join(tmp, 'senses.bin')
+			sense = {'sense_id': 'word.noun.0', 'word': 'word', 'gloss': 'a gloss', 'tags': ('en', 'rare'), 'depth': 1, 'synonyms': ('term',)}
+			save_senses_binary(path, [sense])
+			loaded = load_senses_binary(path)['word.noun.0']
+			self.assertEqual(loaded['tags'], 'en, rare')
+			self.assertEqual(loaded['synonyms'], 'term')
+
+class LazySensesTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name, 'senses.txt')
+		self.senses = [{'sense_id': 'word{}.noun.{}'.format(i//3, i%3), 'word': 'word{}'.format(i//3), 'gloss': 'gloss {}'.format(i),
+			'tags': [], 'depth': 1, 'synonyms': []} for i in range(50)]
+		save_senses(self.path, self.senses)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def test_lookup(self):
+		lazy = load_senses_lazy(self.path)
+		full = load_senses(self.path)
+		self.assertEqual(len(lazy), len(full))
+		for sense_id, sense in full.items():
+			self.assertEqual(lazy[sense_id], sense)
+		self.assertNotIn('word0.noun.3', lazy)
+		self.assertEqual(lazy.senses_of('word1.noun'), ['word1.noun.0', 'word1.noun.1', 'word1.noun.2'])
+
+	#changing a returned sense doesn't change the cached one
+	def test_returns_copy(self):
+		lazy = load_senses_lazy(self.path)
+		lazy['word0.noun.0']['gloss'] = 'changed'
+		self.assertEqual(lazy['word0.noun.0']['gloss'], 'gloss 0')
+
+class SenseIndexTest(unittest.TestCase):
+	#a loaded index looks ids up in their hash buckets, and gives the same ids as a built one
+	def test_loaded_ids(self):
+		sense_ids = ['word{}.noun.{}'.format(i//3, i%3) for i in range(48)]
+		built = build_sense_index(sense_ids)
+		with tempfile.TemporaryDirectory() as tmp:
+			path = os.path.join(tmp, 'sense_index.bin')
+			save_sense_index(path, built)
+			loaded = load_sense_index(path)
+			self.assertIsInstance(loaded.ids, HashIndex)
+			for i, sense_id in enumerate(sense_ids):
+				self.assertEqual(loaded.id(sense_id), i)
+				self.assertEqual(loaded.num_senses(sense_id), 3)
+			self.assertNotIn('word0.noun.3', loaded)
+			self.assertEqual(loaded.ids.get('word0.noun.3', -1), -1)
+
+if __name__ == '__main__':
+	unittest.main()
+
+#EOF
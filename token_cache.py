@@ -0,0 +1,250 @@
+'''
+Copyright (c) Facebook, Inc. and its affiliates.
+All rights reserved.
+This source code is licensed under the license found in the
+LICENSE file in the root directory of this source tree.
+'''
+
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import array
+import collections.abc
+import hashlib
+import importlib
+import itertools
+import multiprocessing
+import os
+
+from utils import *
+
+'''
+This script tokenizes the data splits (and the glosses of senses.txt) with a given
+tokenizer and caches the token ids in binary files, so that training runs load them
+through mmap instead of tokenizing the data again.
+'''
+
+parser = argparse.ArgumentParser(description='Tokenize FEWS data into a token id cache')
+parser.add_argument('--data-files', type=str, nargs='+', required=True,
+	help='Filepaths of the split files (e.g. train.txt, or their .spans.txt files) and/or senses.txt to tokenize')
+parser.add_argument('--tokenizer', type=str, required=True,
+	help='Tokenizer to use, as module:name of a callable that takes a string and returns a list of token ids, or a (token ids, character offsets) pair')
+parser.add_argument('--cache-dir', type=str, required=True,
+	help='Directory in which to save the cached token ids')
+parser.add_argument('--workers', type=int, default=1,
+	help='Number of processes used to tokenize in parallel (1 tokenizes serially)')
+
+TOKEN_CACHE_VERSION = b'1' #changes whenever the format of the cache files does
+TOKENIZE_CHUNK_SIZE = 512 #number of rows sent to a worker process at a time
+#texts tokenized to fingerprint a tokenizer, so that a change in how it tokenizes changes the cache key
+FINGERPRINT_TEXTS = ['The quick brown fox jumps over the lazy dog.',
+	"Don't re-tokenize: naïve café, 1,234.5 ½ — Ærøskøbing 北京 <WSD>mention</WSD>"]
+
+TOKENIZER_STATE = {} #tokenizer of the worker processes
+
+#fingerprint of a tokenizer: its name, its fingerprint attribute if it has one (e.g. a
+#hash of its vocabulary) and the tokens it gives for FINGERPRINT_TEXTS
+def tokenizer_fingerprint(tokenizer):
+	h = hashlib.blake2b(digest_size=16)
+	name = getattr(tokenizer, '__qualname__', type(tokenizer).__qualname__)
+	module = getattr(tokenizer, '__module__', type(tokenizer).__module__)
+	h.update('{}.{}'.format(module, name).encode('utf-8'))
+	fingerprint = getattr(tokenizer, 'fingerprint', None)
+	if fingerprint is not None: h.update(str(fingerprint).encode('utf-8'))
+	for text in FINGERPRINT_TEXTS:
+		h.update(repr(tokenizer(text)).encode('utf-8'))
+	return h.hexdigest()
+
+#filepath of the cache of a data file for a tokenizer (by its fingerprint), named after the
+#data file and a hash of its contents and the fingerprint
+def cache_path(filepath, fingerprint, cache_dir):
+	h = hashlib.blake2b(digest_size=8)
+	h.update(TOKEN_CACHE_VERSION)
+	h.update(fingerprint.encode('utf-8'))
+	h.update(file_hash(filepath).encode('utf-8'))
+	name = os.path.basename(filepath)
+	if name.endswith('.txt'): name = name[:-4]
+	return os.path.join(cache_dir, '{}.{}.tok'.format(name, h.hexdigest()))
+
+#rows (text, label, spans) of a data file: the sentences of a split with the spans of their
+#mentions, or the glosses of senses.txt labeled with their sense ids
+def data_rows(filepath):
+	if os.path.basename(filepath) == 'senses.txt':
+		for sense in load_senses(filepath).values():
+			yield sense['gloss'], sense['sense_id'], ()
+	else:
+		for row in read_shard(filepath, 0, 1):
+			yield row_spans(row)
+
+#tokenizes a text with the spans of its mentions, returning its token ids and the (start, end)
+#token positions of each mention. a tokenizer that gives the character offsets of its tokens
+#tokenizes the whole text, and mentions are the tokens that overlap their spans; otherwise
+#the text is tokenized in pieces split at the mention boundaries
+def tokenize_row(tokenizer, text, spans):
+	out = tokenizer(text)
+	if isinstance(out, tuple) and len(out) == 2 and not isinstance(out[0], int):
+		ids, offsets = out
+		mentions = []
+		for start, end in spans:
+			toks = [i for i, (s, e) in enumerate(offsets) if s < end and e > start]
+			if len(toks) > 0: mentions.append((toks[0], toks[-1]+1))
+			else: mentions.append((0, 0))
+		return list(ids), mentions
+	if len(spans) == 0: return list(out), []
+
+	ids = []
+	mentions = []
+	pos = 0
+	for start, end in spans:
+		if start > pos: ids.extend(tokenizer(text[pos:start]))
+		mention_start = len(ids)
+		ids.extend(tokenizer(text[start:end]))
+		mentions.append((mention_start, len(ids)))
+		pos = end
+	if pos < len(text): ids.extend(tokenizer(text[pos:]))
+	return ids, mentions
+
+def init_tokenizer(tokenizer):
+	TOKENIZER_STATE['tokenizer'] = tokenizer
+
+#tokenizes a chunk of rows (run inside a pool worker), returning the flat token ids of the
+#chunk, the number of tokens of each row, and the mention positions and number of mentions of each row
+def tokenize_chunk(rows):
+	tokenizer = TOKENIZER_STATE['tokenizer']
+	ids = array.array('i')
+	lengths = array.array('i')
+	mention_starts = array.array('i')
+	mention_ends = array.array('i')
+	mention_counts = array.array('i')
+	for text, _, spans in rows:
+		row_ids, mentions = tokenize_row(tokenizer, text, spans)
+		ids.extend(row_ids)
+		lengths.append(len(row_ids))
+		for start, end in mentions:
+			mention_starts.append(start)
+			mention_ends.append(end)
+		mention_counts.append(len(mentions))
+	return ids, lengths, mention_starts, mention_ends, mention_counts
+
+#yields lists of size items of an iterable
+def chunks(items, size):
+	items = iter(items)
+	while True:
+		chunk = list(itertools.islice(items, size))
+		if len(chunk) == 0: return
+		yield chunk
+
+#tokenizes a data file into a cache file (in a pool of workers processes if workers > 1).
+#token ids are stored in one flat column, with the token_offsets of each row, and mention
+#positions likewise with the mention_offsets of each row
+def build_token_cache(filepath, tokenizer, out_path, workers=1):
+	labels = []
+	def rows():
+		for row in data_rows(filepath):
+			labels.append(row[1])
+			yield row
+
+	ids = array.array('i')
+	token_offsets = [0]
+	mention_starts = array.array('i')
+	mention_ends = array.array('i')
+	mention_offsets = [0]
+	if workers > 1:
+		pool = multiprocessing.Pool(workers, init_tokenizer, (tokenizer,))
+		results = pool.imap(tokenize_chunk, chunks(rows(), TOKENIZE_CHUNK_SIZE))
+	else:
+		pool = None
+		init_tokenizer(tokenizer)
+		results = map(tokenize_chunk, chunks(rows(), TOKENIZE_CHUNK_SIZE))
+	for chunk_ids, lengths, starts, ends, counts in results:
+		ids.extend(chunk_ids)
+		for n in lengths: token_offsets.append(token_offsets[-1]+n)
+		mention_starts.extend(starts)
+		mention_ends.extend(ends)
+		for n in counts: mention_offsets.append(mention_offsets[-1]+n)
+	if pool is not None:
+		pool.close()
+		pool.join()
+
+	columns = {'token_id': ids,
+		'token_offsets': token_offsets,
+		'mention_start': mention_starts,
+		'mention_end': mention_ends,
+		'mention_offsets': mention_offsets,
+		'label': labels}
+	#written under a temporary name, so a cache file is always complete
+	save_binary(out_path+'.tmp', 'tokc', columns)
+	os.replace(out_path+'.tmp', out_path)
+	return
+
+#token ids of a data file cached by build_token_cache, as a sequence of (token ids, label,
+#mentions) rows, with token ids an int memoryview of the mapped file and mentions a list of
+#(start, end) token positions. the flat columns can also be used directly (see build_token_cache)
+class TokenCache(collections.abc.Sequence):
+	def __init__(self, filepath):
+		self.filepath = filepath
+		_, columns = load_binary(filepath)
+		self.token_ids = columns['token_id']
+		self.token_offsets = columns['token_offsets']
+		self.mention_starts = columns['mention_start']
+		self.mention_ends = columns['mention_end']
+		self.mention_offsets = columns['mention_offsets']
+		self.labels = columns['label']
+
+	def __len__(self):
+		return len(self.labels)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if i < 0: i += len(self)
+		if not 0 <= i < len(self): raise IndexError('token cache index out of range')
+		ids = self.token_ids[self.token_offsets[i]:self.token_offsets[i+1]]
+		m = range(self.mention_offsets[i], self.mention_offsets[i+1])
+		mentions = [(self.mention_starts[j], self.mention_ends[j]) for j in m]
+		return ids, self.labels[i], mentions
+
+	#pickled by path (e.g. for dataloader workers), which map the file again
+	def __getstate__(self):
+		return {'filepath': self.filepath}
+
+	def __setstate__(self, state):
+		self.__init__(state['filepath'])
+
+#load a token cache file (see TokenCache)
+def load_token_cache(filepath):
+	return TokenCache(filepath)
+
+#loads the token ids of a data file tokenized by tokenizer from cache_dir, tokenizing it
+#first if the file or the tokenizer (see tokenizer_fingerprint) changed since it was cached
+def load_tokenized(filepath, tokenizer, cache_dir, workers=1, fingerprint=None):
+	if fingerprint is None: fingerprint = tokenizer_fingerprint(tokenizer)
+	path = cache_path(filepath, fingerprint, cache_dir)
+	if not os.path.exists(path):
+		if not os.path.exists(cache_dir): os.makedirs(cache_dir)
+		build_token_cache(filepath, tokenizer, path, workers)
+	return load_token_cache(path)
+
+#gets a tokenizer callable given as module:name
+def import_tokenizer(spec):
+	module, _, name = spec.partition(':')
+	tokenizer = importlib.import_module(module)
+	for attr in name.split('.'):
+		tokenizer = getattr(tokenizer, attr)
+	return tokenizer
+
+def main(args):
+	tokenizer = import_tokenizer(args.tokenizer)
+	fingerprint = tokenizer_fingerprint(tokenizer)
+	for filepath in args.data_files:
+		path = cache_path(filepath, fingerprint, args.cache_dir)
+		cached = os.path.exists(path)
+		cache = load_tokenized(filepath, tokenizer, args.cache_dir, args.workers, fingerprint)
+		print(filepath, path, len(cache), len(cache.token_ids), 'cached' if cached else 'tokenized')
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	main(args)
+
+#EOF
@@ -9,6 +9,19 @@ LICENSE file in the root directory of this source tree.
 # -*- coding: utf-8 -*-
 #UTILITIES for dataset creation and data loading
 
+import array
+import collections
+import collections.abc
+import hashlib
+import mmap
+import os
+import queue
+import random
+import struct
+import sys
+import threading
+import zlib
+
 def get_key(label, use_pos):
 	if use_pos: key = '.'.join(label.split('.')[:2])
 	else: key = label.split('.')[0]
@@ -34,11 +47,16 @@ def load_senses(filepath):
 				s[key] = value
 	return senses
 
-#load examples (data instances w/o attributions) from txt file
-def load_examples(filepath):
+#load examples (data instances w/o attributions) from txt file; with spans, each example is
+#(sentence without <WSD> markers, label, spans) instead (see mention_spans), with the spans
+#read from a .spans.txt file or found in the sentence otherwise
+def load_examples(filepath, spans=False):
 	examples = []
 	with open(filepath, 'r') as f:
 		for line in f:
+			if spans:
+				examples.append(row_spans(line.strip().split('\t')))
+				continue
 			sent, label = line.strip().split('\t')
 			examples.append((sent, label))
 	return examples
@@ -56,17 +74,145 @@ def load_quotations(filepath):
 			quotations.append((sent, label, attrib))
 	return quotations
 
+#tuples of tags shared by all senses with the same tags
+INTERNED_TAGS = {}
+
+#interns a list of tags as a shared tuple of interned strings
+def intern_tags(tags):
+	tags = tuple(sys.intern(t) for t in tags)
+	return INTERNED_TAGS.setdefault(tags, tags)
+
+#sense object built by the parser, used like a dict (e.g. sense['gloss']) but with
+#__slots__ instead of a dict per sense. pos and tags are interned and tags, examples,
+#quotations and synonyms are tuples, with all senses that have none sharing the empty
+#tuple. sense_id is only set by post-processing (and fields are removed with pop)
+class Sense:
+	__slots__ = ('word', 'gloss', 'pos', 'tags', 'examples', 'quotations', 'synonyms', 'depth', 'sense_id')
+
+	def __init__(self, word, pos, gloss='', tags=(), examples=(), quotations=(), synonyms=(), depth=-1):
+		self.word = word
+		self.gloss = gloss
+		self.pos = sys.intern(pos)
+		self.tags = intern_tags(tags)
+		self.examples = tuple(examples)
+		self.quotations = tuple(quotations)
+		self.synonyms = tuple(synonyms)
+		self.depth = depth
+
+	def __getitem__(self, key):
+		try:
+			return getattr(self, key)
+		except AttributeError:
+			raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		if key not in self.__slots__: raise KeyError(key)
+		setattr(self, key, value)
+
+	def __contains__(self, key):
+		return key in self.__slots__ and hasattr(self, key)
+
+	def get(self, key, default=None):
+		if key in self: return getattr(self, key)
+		return default
+
+	def pop(self, key):
+		value = self[key]
+		delattr(self, key)
+		return value
+
+	def keys(self):
+		return [k for k in self.__slots__ if hasattr(self, k)]
+
+	def __eq__(self, other):
+		if not isinstance(other, Sense): return NotImplemented
+		return self.__getstate__() == other.__getstate__()
+
+	def __repr__(self):
+		return 'Sense({})'.format(self.__getstate__())
+
+	#pickled (e.g. from the parse workers) as a dict of the fields that are set;
+	#pos and tags are interned again when unpickled
+	def __getstate__(self):
+		return {k: getattr(self, k) for k in self.keys()}
+
+	def __setstate__(self, state):
+		for k, v in state.items():
+			setattr(self, k, v)
+		if 'pos' in state: self.pos = sys.intern(self.pos)
+		if 'tags' in state: self.tags = intern_tags(self.tags)
+
+#write a single sense to an open senses.txt file
+def write_sense(f, sense):
+	sense_str = 'sense_id:\t'+sense['sense_id']+'\n'
+	sense_str += 'word:\t'+sense['word']+'\n'
+	sense_str += 'gloss:\t'+ sense['gloss']+'\n'
+	sense_str += 'tags:\t'+', '.join(sense['tags'])+'\n'
+	sense_str += 'depth:\t'+str(sense['depth'])+'\n'
+	sense_str += 'synonyms:\t'+', '.join(sense['synonyms'])+'\n\n'
+	f.write(sense_str)
+
+#write a single quotation (with attribution) to an open txt file
+def write_quotation(f, quote):
+	attrib = quote[2]
+	if isinstance(attrib, (list, tuple)): attrib = '; '.join(attrib)
+	quote_str = quote[0]+'\t'+quote[1]+'\t'+attrib+'\n'
+	f.write(quote_str)
+
+#write a single data example to an open txt file
+def write_example(f, ex):
+	ex_str = ex[0]+'\t'+ex[1]+'\n'
+	f.write(ex_str)
+
+#sentences mark the mentions of the labeled sense's word with <WSD>...</WSD>
+WSD_START = '<WSD>'
+WSD_END = '</WSD>'
+
+#removes the <WSD> markers from a sentence, returning the clean sentence and the (start, end)
+#character offsets of the marked mentions in it, so that clean_sent[start:end] is a mention
+def mention_spans(sent):
+	parts = []
+	spans = []
+	pos = 0
+	length = 0
+	while True:
+		start = sent.find(WSD_START, pos)
+		if start < 0: break
+		end = sent.find(WSD_END, start)
+		if end < 0: break
+		mention = sent[start+len(WSD_START):end]
+		parts.append(sent[pos:start])
+		length += start-pos
+		parts.append(mention)
+		spans.append((length, length+len(mention)))
+		length += len(mention)
+		pos = end+len(WSD_END)
+	if len(spans) == 0: return sent, ()
+	parts.append(sent[pos:])
+	return ''.join(parts), tuple(spans)
+
+#gets (clean sentence, label, spans) from the fields of a row of a data file: a .spans.txt
+#row has the spans in its third field, as start-end pairs separated by spaces; other rows
+#have the <WSD> markers in their sentence
+def row_spans(row):
+	if len(row) > 2:
+		spans = tuple(tuple(int(o) for o in span.split('-')) for span in row[2].split(' '))
+		return (row[0], row[1], spans)
+	sent, spans = mention_spans(row[0])
+	return (sent, row[1], spans)
+
+#write a single data example to an open .spans.txt file: its sentence without <WSD> markers,
+#its label and the character offsets of the marked mentions (see row_spans)
+def write_example_spans(f, ex):
+	sent, spans = mention_spans(ex[0])
+	ex_str = sent+'\t'+ex[1]+'\t'+' '.join('{}-{}'.format(start, end) for start, end in spans)+'\n'
+	f.write(ex_str)
+
 #save dict of senses to txt file
 def save_senses(filepath, senses):
 	f = open(filepath, 'w')
 	for sense in senses:
-		sense_str = 'sense_id:\t'+sense['sense_id']+'\n'
-		sense_str += 'word:\t'+sense['word']+'\n'
-		sense_str += 'gloss:\t'+ sense['gloss']+'\n'
-		sense_str += 'tags:\t'+', '.join(sense['tags'])+'\n'
-		sense_str += 'depth:\t'+str(sense['depth'])+'\n'
-		sense_str += 'synonyms:\t'+', '.join(sense['synonyms'])+'\n\n'
-		f.write(sense_str)
+		write_sense(f, sense)
 	f.close()
 	return
 
@@ -74,10 +220,7 @@ def save_senses(filepath, senses):
 def save_quotations(filepath, quotations):
 	f = open(filepath, 'w')
 	for quote in quotations:
-		attrib = quote[2]
-		if type(attrib) == list: attrib = '; '.join(attrib)
-		quote_str = quote[0]+'\t'+quote[1]+'\t'+attrib+'\n'
-		f.write(quote_str)
+		write_quotation(f, quote)
 	f.close()
 	return
 
@@ -85,9 +228,849 @@ def save_quotations(filepath, quotations):
 def save_examples(filepath, examples):
 	f = open(filepath, 'w')
 	for ex in examples:
-		ex_str = ex[0]+'\t'+ex[1]+'\n'
-		f.write(ex_str)
+		write_example(f, ex)
+	f.close()
+	return
+
+#saves list of data examples to a .spans.txt file (see write_example_spans)
+def save_examples_spans(filepath, examples):
+	f = open(filepath, 'w')
+	for ex in examples:
+		write_example_spans(f, ex)
+	f.close()
+	return
+
+#binary dataset files: a header followed by named columns, each either a list of ints (int32,
+#or int64 if needed) or a list of strings (uint64 offsets into a utf-8 blob). files are read through
+#mmap, so the loaders below give random access without parsing (or copying) the file,
+#and processes loading the same file share one page-cached copy of it
+BINARY_MAGIC = b'FEWSBIN1'
+BINARY_HEADER = struct.Struct('<8s4sI') #magic, kind of data, number of columns
+BINARY_COLUMN = struct.Struct('<32scxxxxxxxQQQ') #name, type, rows, offsets position, data position
+
+#pads a file to a multiple of 8 bytes, so arrays stored after it are aligned
+def _align(f):
+	pad = -f.tell()%8
+	f.write(b'\0'*pad)
+
+#little-endian array of the given type with the given values
+def _le_array(typecode, values):
+	a = array.array(typecode, values)
+	if sys.byteorder != 'little': a.byteswap()
+	return a
+
+#save columns (dict of column name to a list of strs or a list of ints) to a binary file
+def save_binary(filepath, kind, columns):
+	f = open(filepath, 'wb')
+	header_size = BINARY_HEADER.size+BINARY_COLUMN.size*len(columns)
+	f.write(b'\0'*header_size)
+	entries = []
+	for name, values in columns.items():
+		_align(f)
+		if len(values) > 0 and isinstance(values[0], str):
+			data = [v.encode('utf-8') for v in values]
+			offsets = [0]
+			for d in data: offsets.append(offsets[-1]+len(d))
+			offsets_pos = f.tell()
+			f.write(_le_array('Q', offsets).tobytes())
+			data_pos = f.tell()
+			for d in data: f.write(d)
+			entries.append((name, b's', len(values), offsets_pos, data_pos))
+		else:
+			typ = 'i'
+			if len(values) > 0 and (min(values) < -2**31 or max(values) >= 2**31): typ = 'q'
+			data_pos = f.tell()
+			f.write(_le_array(typ, values).tobytes())
+			entries.append((name, typ.encode('ascii'), len(values), 0, data_pos))
+	f.seek(0)
+	f.write(BINARY_HEADER.pack(BINARY_MAGIC, kind.encode('ascii'), len(columns)))
+	for name, typ, rows, offsets_pos, data_pos in entries:
+		f.write(BINARY_COLUMN.pack(name.encode('utf-8'), typ, rows, offsets_pos, data_pos))
 	f.close()
 	return
 
+#read-only view of an int column of a binary file (a memoryview of the mapped file)
+def _int_column(buf, pos, rows, typ='i'):
+	view = buf[pos:pos+struct.calcsize(typ)*rows]
+	if sys.byteorder != 'little': #copy into native byte order
+		a = array.array(typ, view.tobytes())
+		a.byteswap()
+		return memoryview(a)
+	return view.cast(typ)
+
+#string column of a binary file, decoded on access
+class StringColumn(collections.abc.Sequence):
+	def __init__(self, buf, offsets_pos, data_pos, rows):
+		self.buf = buf
+		self.data_pos = data_pos
+		self.rows = rows
+		view = buf[offsets_pos:offsets_pos+8*(rows+1)]
+		if sys.byteorder != 'little':
+			a = array.array('Q', view.tobytes())
+			a.byteswap()
+			view = memoryview(a)
+		self.offsets = view.cast('Q')
+
+	def __len__(self):
+		return self.rows
+
+	#utf-8 bytes of the i-th string, as a memoryview of the mapped file (no copy)
+	def raw(self, i):
+		return self.buf[self.data_pos+self.offsets[i]:self.data_pos+self.offsets[i+1]]
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(self.rows))]
+		if i < 0: i += self.rows
+		if not 0 <= i < self.rows: raise IndexError('string column index out of range')
+		return str(self.raw(i), 'utf-8')
+
+#load a binary file saved by save_binary, returning its kind and a dict of its columns
+def load_binary(filepath):
+	f = open(filepath, 'rb')
+	mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	f.close()
+	buf = memoryview(mm)
+	magic, kind, n_columns = BINARY_HEADER.unpack_from(buf, 0)
+	if magic != BINARY_MAGIC: raise ValueError('{} is not a binary FEWS file'.format(filepath))
+	columns = {}
+	for c in range(n_columns):
+		name, typ, rows, offsets_pos, data_pos = BINARY_COLUMN.unpack_from(buf, BINARY_HEADER.size+c*BINARY_COLUMN.size)
+		name = name.rstrip(b'\0').decode('utf-8')
+		if typ == b's': columns[name] = StringColumn(buf, offsets_pos, data_pos, rows)
+		else: columns[name] = _int_column(buf, data_pos, rows, typ.decode('ascii'))
+	return kind.decode('ascii'), columns
+
+#save examples (sentence, label) to a binary file, with the attributions of quotations
+#if given; labels are stored as integer ids into a table of the distinct labels
+def _save_examples_binary(filepath, examples, attributions=None):
+	label_ids = {}
+	ids = []
+	for ex in examples:
+		label = ex[1]
+		if label not in label_ids: label_ids[label] = len(label_ids)
+		ids.append(label_ids[label])
+	columns = {'sentence': [ex[0] for ex in examples],
+		'label_id': ids,
+		'label': list(label_ids)}
+	kind = 'exam'
+	if attributions is not None:
+		kind = 'quot'
+		columns['attribution'] = attributions
+	save_binary(filepath, kind, columns)
+	return
+
+#saves list on data examples to a binary file
+def save_examples_binary(filepath, examples):
+	_save_examples_binary(filepath, examples)
+	return
+
+#save list of quotations (with attribution) to a binary file
+def save_quotations_binary(filepath, quotations):
+	attribs = []
+	for quote in quotations:
+		attrib = quote[2]
+		if isinstance(attrib, (list, tuple)): attrib = '; '.join(attrib)
+		attribs.append(attrib)
+	_save_examples_binary(filepath, quotations, attribs)
+	return
+
+#examples (or quotations) in a binary file, as a sequence of the same tuples
+#load_examples (or load_quotations) returns. the columns can also be used directly:
+#sentences (decoded on access, or as raw bytes with sentences.raw(i)),
+#label_ids (an int memoryview) and labels (the label of each label id)
+class BinaryExamples(collections.abc.Sequence):
+	def __init__(self, filepath):
+		self.filepath = filepath
+		self.kind, columns = load_binary(filepath)
+		self.sentences = columns['sentence']
+		self.label_ids = columns['label_id']
+		self.labels = columns['label']
+		self.attributions = columns.get('attribution')
+
+	def __len__(self):
+		return len(self.sentences)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if i < 0: i += len(self)
+		sent = self.sentences[i]
+		label = self.labels[self.label_ids[i]]
+		if self.attributions is not None: return (sent, label, self.attributions[i])
+		return (sent, label)
+
+	#pickled by path (e.g. for dataloader workers), which map the file again
+	def __getstate__(self):
+		return {'filepath': self.filepath}
+
+	def __setstate__(self, state):
+		self.__init__(state['filepath'])
+
+#load examples from a binary file (see BinaryExamples)
+def load_examples_binary(filepath):
+	return BinaryExamples(filepath)
+
+#load quotations from a binary file (see BinaryExamples)
+def load_quotations_binary(filepath):
+	return BinaryExamples(filepath)
+
+SENSE_FIELDS = ['sense_id', 'word', 'gloss', 'tags', 'depth', 'synonyms']
+
+#save senses (a dict as returned by load_senses, or a list of sense objects) to a binary file
+def save_senses_binary(filepath, senses):
+	if isinstance(senses, dict): senses = list(senses.values())
+	columns = {}
+	for field in SENSE_FIELDS:
+		values = []
+		for sense in senses:
+			v = sense.get(field, '')
+			if isinstance(v, (list, tuple)): v = ', '.join(v)
+			values.append(str(v))
+		columns[field] = values
+	#rows sorted by sense id, for looking senses up by binary search
+	columns['by_id'] = sorted(range(len(senses)), key=lambda i: columns['sense_id'][i])
+	save_binary(filepath, 'sens', columns)
+	return
+
+#senses in a binary file, as a read-only mapping of sense_id to the same sense dicts
+#load_senses returns; senses are decoded only when accessed
+class BinarySenses(collections.abc.Mapping):
+	def __init__(self, filepath):
+		self.filepath = filepath
+		self.kind, self.columns = load_binary(filepath)
+		self.sense_ids = self.columns['sense_id']
+		self.by_id = self.columns['by_id']
+
+	#row of the given sense id, or -1 if there is no such sense
+	def find(self, sense_id):
+		lo = 0
+		hi = len(self.by_id)
+		while lo < hi:
+			mid = (lo+hi)//2
+			if self.sense_ids[self.by_id[mid]] < sense_id: lo = mid+1
+			else: hi = mid
+		if lo < len(self.by_id) and self.sense_ids[self.by_id[lo]] == sense_id: return self.by_id[lo]
+		return -1
+
+	#the sense dict stored in the i-th row
+	def row(self, i):
+		return {field: self.columns[field][i] for field in SENSE_FIELDS}
+
+	def __getitem__(self, sense_id):
+		i = self.find(sense_id)
+		if i < 0: raise KeyError(sense_id)
+		return self.row(i)
+
+	def __contains__(self, sense_id):
+		return self.find(sense_id) >= 0
+
+	def __len__(self):
+		return len(self.sense_ids)
+
+	def __iter__(self):
+		return iter(self.sense_ids)
+
+	def __getstate__(self):
+		return {'filepath': self.filepath}
+
+	def __setstate__(self, state):
+		self.__init__(state['filepath'])
+
+#load senses from a binary file (see BinarySenses)
+def load_senses_binary(filepath):
+	return BinarySenses(filepath)
+
+#converts a senses.txt, examples or quotations file into the binary format,
+#saving it next to the original with a .bin extension (or at binary_path)
+def convert_to_binary(filepath, kind, binary_path=None):
+	if binary_path is None:
+		if filepath.endswith('.txt'): binary_path = filepath[:-4]+'.bin'
+		else: binary_path = filepath+'.bin'
+	if kind == 'senses': save_senses_binary(binary_path, load_senses(filepath))
+	elif kind == 'quotations': save_quotations_binary(binary_path, load_quotations(filepath))
+	elif kind == 'examples': save_examples_binary(binary_path, load_examples(filepath))
+	else: raise ValueError('unknown kind of data file: {}'.format(kind))
+	return binary_path
+
+#parses the lines of one sense block of senses.txt into a sense dict (as load_senses does)
+def parse_sense(lines):
+	s = {}
+	for line in lines:
+		line = line.strip().split(':\t')
+		key = line[0]
+		if len(line) > 1: value = line[1]
+		else:
+			key = key[:-1]
+			value = ''
+		s[key] = value
+	return s
+
+#sizes and modification times of files, to check a saved index is up to date with them
+def file_stamps(filepaths):
+	stamps = []
+	for filepath in filepaths:
+		st = os.stat(filepath)
+		stamps.extend([st.st_size, st.st_mtime_ns])
+	return stamps
+
+#hash of the contents of a file
+def file_hash(filepath):
+	h = hashlib.blake2b(digest_size=16)
+	with open(filepath, 'rb') as f:
+		while True:
+			block = f.read(2**20)
+			if len(block) == 0: break
+			h.update(block)
+	return h.hexdigest()
+
+#hash index of a column of strings (e.g. sense ids), for looking rows up by their string in
+#constant time: the rows grouped by the crc32 hash bucket of their string (one bucket per row),
+#returned as by_hash and bucket_start columns, the rows of bucket b being
+#by_hash[bucket_start[b]:bucket_start[b+1]]. crc32 rather than hash(), which differs between processes
+def _hash_buckets(values):
+	n_buckets = max(len(values), 1)
+	buckets = [zlib.crc32(v.encode('utf-8'))%n_buckets for v in values]
+	by_hash = sorted(range(len(values)), key=lambda i: buckets[i])
+	bucket_start = [0]*(n_buckets+1)
+	for b in buckets: bucket_start[b+1] += 1
+	for b in range(n_buckets): bucket_start[b+1] += bucket_start[b]
+	return by_hash, bucket_start
+
+#row of a string in a column indexed by _hash_buckets, or -1 if it isn't in the column;
+#only the rows of its bucket are compared (as utf-8 bytes, without decoding, for a StringColumn)
+def _hash_find(values, by_hash, bucket_start, value):
+	if not isinstance(value, str): return -1
+	data = value.encode('utf-8')
+	b = zlib.crc32(data)%(len(bucket_start)-1)
+	for j in range(bucket_start[b], bucket_start[b+1]):
+		i = by_hash[j]
+		if isinstance(values, StringColumn):
+			if values.raw(i) == data: return i
+		elif values[i] == value: return i
+	return -1
+
+#read-only mapping of the strings of a column indexed by _hash_buckets to their rows
+class HashIndex(collections.abc.Mapping):
+	def __init__(self, values, by_hash, bucket_start):
+		self.values = values
+		self.by_hash = by_hash
+		self.bucket_start = bucket_start
+
+	def __getitem__(self, value):
+		i = _hash_find(self.values, self.by_hash, self.bucket_start, value)
+		if i < 0: raise KeyError(value)
+		return i
+
+	def get(self, value, default=None):
+		i = _hash_find(self.values, self.by_hash, self.bucket_start, value)
+		return default if i < 0 else i
+
+	def __contains__(self, value):
+		return _hash_find(self.values, self.by_hash, self.bucket_start, value) >= 0
+
+	def __len__(self):
+		return len(self.values)
+
+	def __iter__(self):
+		return iter(self.values)
+
+#builds a byte-offset index of the sense blocks in senses.txt, saved at index_path
+def build_senses_index(filepath, index_path):
+	rows = {}
+	with open(filepath, 'rb') as f:
+		pos = 0
+		start = 0
+		end = 0
+		sense_id = None
+		for line in f:
+			stripped = line.strip()
+			if len(stripped) == 0:
+				rows[sense_id] = (start, end-start)
+				start = pos+len(line)
+				sense_id = None
+			else:
+				if stripped.startswith(b'sense_id:'):
+					sense_id = parse_sense([stripped.decode('utf-8')])['sense_id']
+				end = pos+len(line.rstrip(b'\n'))
+			pos += len(line)
+	sense_ids = list(rows)
+	#rows by the hash bucket of their sense id, for looking senses up in constant time
+	by_hash, bucket_start = _hash_buckets(sense_ids)
+	columns = {'sense_id': sense_ids,
+		'offset': [rows[s][0] for s in sense_ids],
+		'length': [rows[s][1] for s in sense_ids],
+		'by_hash': by_hash,
+		'bucket_start': bucket_start,
+		#rows sorted by word.pos key, for binary search
+		'by_key': sorted(range(len(sense_ids)), key=lambda i: (get_key(sense_ids[i], use_pos=True), i)),
+		'source': file_stamps([filepath])}
+	save_binary(index_path, 'sidx', columns)
+	return
+
+#sense inventory of a senses.txt file that parses senses lazily: a read-only mapping of
+#sense_id to the same sense dicts load_senses returns, backed by a persistent byte-offset
+#index (saved at index_path, senses.txt.idx by default, and rebuilt when senses.txt changes).
+#recently accessed senses are kept decoded in an LRU cache of cache_size entries; each access
+#returns a copy of the sense dict, so changing it doesn't change the cached sense
+class LazySenses(collections.abc.Mapping):
+	def __init__(self, filepath, index_path=None, cache_size=4096):
+		self.filepath = filepath
+		if index_path is None: index_path = filepath+'.idx'
+		self.index_path = index_path
+		self.cache_size = cache_size
+
+		st = os.stat(filepath)
+		columns = None
+		if os.path.exists(index_path):
+			_, columns = load_binary(index_path)
+			#indexes made before the hash buckets were added are rebuilt too
+			if 'by_hash' not in columns or columns['source'].tolist() != file_stamps([filepath]): columns = None
+		if columns is None:
+			build_senses_index(filepath, index_path)
+			_, columns = load_binary(index_path)
+		self.sense_ids = columns['sense_id']
+		self.offsets = columns['offset']
+		self.lengths = columns['length']
+		self.by_hash = columns['by_hash']
+		self.bucket_start = columns['bucket_start']
+		self.by_key = columns['by_key']
+
+		f = open(filepath, 'rb')
+		if st.st_size > 0: self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		else: self.data = b''
+		f.close()
+		self.cache = collections.OrderedDict()
+
+	#row of the given sense id in the index (from its hash bucket), or -1 if there is no such sense
+	def find(self, sense_id):
+		return _hash_find(self.sense_ids, self.by_hash, self.bucket_start, sense_id)
+
+	#sense ids of a word.pos key (see get_key), in file order
+	def senses_of(self, key):
+		lo = 0
+		hi = len(self.by_key)
+		while lo < hi:
+			mid = (lo+hi)//2
+			if get_key(self.sense_ids[self.by_key[mid]], use_pos=True) < key: lo = mid+1
+			else: hi = mid
+		senses = []
+		while lo < len(self.by_key):
+			sense_id = self.sense_ids[self.by_key[lo]]
+			if get_key(sense_id, use_pos=True) != key: break
+			senses.append(sense_id)
+			lo += 1
+		return senses
+
+	def __getitem__(self, sense_id):
+		if sense_id in self.cache:
+			self.cache.move_to_end(sense_id)
+			return dict(self.cache[sense_id])
+		i = self.find(sense_id)
+		if i < 0: raise KeyError(sense_id)
+		block = self.data[self.offsets[i]:self.offsets[i]+self.lengths[i]]
+		sense = parse_sense(block.decode('utf-8').split('\n'))
+		self.cache[sense_id] = sense
+		if len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+		return dict(sense)
+
+	def __contains__(self, sense_id):
+		return sense_id in self.cache or self.find(sense_id) >= 0
+
+	def __len__(self):
+		return len(self.sense_ids)
+
+	def __iter__(self):
+		return iter(self.sense_ids)
+
+	def __getstate__(self):
+		return {'filepath': self.filepath, 'index_path': self.index_path, 'cache_size': self.cache_size}
+
+	def __setstate__(self, state):
+		self.__init__(state['filepath'], state['index_path'], state['cache_size'])
+
+#load senses lazily from senses.txt (see LazySenses)
+def load_senses_lazy(filepath, index_path=None, cache_size=4096):
+	return LazySenses(filepath, index_path, cache_size)
+
+#yields the rows (tuples of tab-separated fields, as load_examples returns) of the lines of
+#a data file that start in the byte range of the given shard, out of num_shards equal ranges
+#(with the byte offset of each line if offsets is set)
+def read_shard(filepath, shard, num_shards, offsets=False):
+	size = os.path.getsize(filepath)
+	start = size*shard//num_shards
+	end = size*(shard+1)//num_shards
+	with open(filepath, 'rb') as f:
+		#skip the line that started in the previous range
+		if start > 0:
+			f.seek(start-1)
+			f.readline()
+		pos = f.tell()
+		while pos < end:
+			line = f.readline()
+			if len(line) == 0: break
+			row = tuple(line.decode('utf-8').strip().split('\t'))
+			if offsets: yield pos, row
+			else: yield row
+			pos += len(line)
+
+#shuffles a stream of items with a buffer of buffer_size items
+def shuffle_stream(items, buffer_size, rng):
+	buf = []
+	for x in items:
+		if len(buf) < buffer_size: buf.append(x)
+		else:
+			i = rng.randrange(buffer_size)
+			yield buf[i]
+			buf[i] = x
+	rng.shuffle(buf)
+	for x in buf: yield x
+
+#streams fixed-size batches of rows from one or more data files (e.g. train.txt, train.ext.txt)
+#without loading them: each file is split into byte ranges, one per (rank, worker) shard, so
+#every data-parallel rank and dataloader worker reads its own lines. rows are shuffled through
+#a buffer of shuffle_buffer rows (seeded by seed, the shard and the epoch; 0 keeps file order)
+#and batches are read ahead on a background thread, prefetch batches at a time.
+#with spans, rows are (clean sentence, label, spans), as load_examples gives them
+class StreamingExamples:
+	def __init__(self, filepaths, batch_size, rank=0, world_size=1, worker=0, num_workers=1,
+		shuffle_buffer=0, seed=0, drop_last=False, prefetch=2, spans=False):
+		if isinstance(filepaths, str): filepaths = [filepaths]
+		self.filepaths = list(filepaths)
+		self.batch_size = batch_size
+		self.shard = rank*num_workers+worker
+		self.num_shards = world_size*num_workers
+		self.shuffle_buffer = shuffle_buffer
+		self.seed = seed
+		self.drop_last = drop_last
+		self.prefetch = prefetch
+		self.spans = spans
+		self.epoch = 0
+
+	#changes the shuffle order for a new epoch
+	def set_epoch(self, epoch):
+		self.epoch = epoch
+
+	#yields the batches of this shard, without prefetching
+	def batches(self):
+		rows = (row for filepath in self.filepaths for row in read_shard(filepath, self.shard, self.num_shards))
+		if self.spans: rows = (row_spans(row) for row in rows)
+		if self.shuffle_buffer > 0:
+			rng = random.Random('{}-{}-{}'.format(self.seed, self.shard, self.epoch))
+			rows = shuffle_stream(rows, self.shuffle_buffer, rng)
+		batch = []
+		for row in rows:
+			batch.append(row)
+			if len(batch) == self.batch_size:
+				yield batch
+				batch = []
+		if len(batch) > 0 and not self.drop_last: yield batch
+
+	def __iter__(self):
+		if self.prefetch <= 0:
+			yield from self.batches()
+			return
+
+		q = queue.Queue(maxsize=self.prefetch)
+		stop = threading.Event()
+		#puts an item on the queue unless iteration stops first; returns whether it was put
+		def put(item):
+			while not stop.is_set():
+				try:
+					q.put(item, timeout=0.1)
+					return True
+				except queue.Full: pass
+			return False
+		def produce():
+			try:
+				for batch in self.batches():
+					if not put(('batch', batch)): return
+				put(('end', None))
+			except BaseException as e:
+				put(('error', e))
+		thread = threading.Thread(target=produce, daemon=True)
+		thread.start()
+		try:
+			while True:
+				kind, x = q.get()
+				if kind == 'end': break
+				elif kind == 'error': raise x
+				yield x
+		finally:
+			#stop the reader if iteration ends early
+			stop.set()
+			thread.join()
+
+#index of a sense inventory: integer ids of the senses (their order in senses.txt), the senses
+#of each word.pos key (or word, see get_key), and the number of quotations and examples of
+#each sense. columns are lists (or int memoryviews and StringColumns when loaded from file):
+#sense_ids, key_ids (key of each sense), keys (sorted), key_offsets and key_senses (the ids
+#of the senses of keys[k] are key_senses[key_offsets[k]:key_offsets[k+1]]),
+#quotation_support and example_support, and by_hash and bucket_start (see _hash_buckets)
+class SenseIndex:
+	def __init__(self, columns):
+		self.columns = columns
+		self.sense_ids = columns['sense_id']
+		self.key_ids = columns['key_id']
+		self.keys = columns['key']
+		self.key_offsets = columns['key_offsets']
+		self.key_senses = columns['key_senses']
+		self.quotation_support = columns['quotation_support']
+		self.example_support = columns['example_support']
+		self.use_pos = bool(columns['use_pos'][0])
+		self.source = list(columns.get('source', []))
+		#missing from indexes saved before they were added
+		self.by_hash = columns.get('by_hash')
+		self.bucket_start = columns.get('bucket_start')
+		self._ids = None
+
+	#mapping of sense_id -> integer id; a loaded index looks each sense id up in its hash
+	#bucket, so its sense ids are not all decoded into a dict on first use
+	@property
+	def ids(self):
+		if self._ids is None:
+			if self.by_hash is not None: self._ids = HashIndex(self.sense_ids, self.by_hash, self.bucket_start)
+			else: self._ids = dict(zip(self.sense_ids, range(len(self.sense_ids))))
+		return self._ids
+
+	def __len__(self):
+		return len(self.sense_ids)
+
+	def __contains__(self, sense_id):
+		return sense_id in self.ids
+
+	#integer id of a sense
+	def id(self, sense_id):
+		return self.ids[sense_id]
+
+	#key of a sense
+	def key(self, sense_id):
+		return self.keys[self.key_ids[self.ids[sense_id]]]
+
+	#number of senses with the same key as the given sense (1 if it is monosemous)
+	def num_senses(self, sense_id):
+		k = self.key_ids[self.ids[sense_id]]
+		return self.key_offsets[k+1]-self.key_offsets[k]
+
+	#index of a key in keys, or -1 if no sense has that key
+	def key_id(self, key):
+		lo = 0
+		hi = len(self.keys)
+		while lo < hi:
+			mid = (lo+hi)//2
+			if self.keys[mid] < key: lo = mid+1
+			else: hi = mid
+		if lo == len(self.keys) or self.keys[lo] != key: return -1
+		return lo
+
+	#sense ids of a key, in senses.txt order
+	def senses_of(self, key):
+		k = self.key_id(key)
+		if k < 0: return []
+		return [self.sense_ids[i] for i in self.key_senses[self.key_offsets[k]:self.key_offsets[k+1]]]
+
+	#number of quotations (or examples) of a sense
+	def support(self, sense_id, kind='quotations'):
+		i = self.ids.get(sense_id)
+		if i is None: return 0
+		if kind == 'quotations': return self.quotation_support[i]
+		elif kind == 'examples': return self.example_support[i]
+		else: raise ValueError('unknown kind of support: {}'.format(kind))
+
+#builds the index of a sense inventory (a dict as returned by load_senses, or any iterable
+#of sense ids) and the labels of its quotations and examples
+def build_sense_index(senses, quotations=(), examples=(), use_pos=True, source=None):
+	sense_ids = list(senses)
+	ids = dict(zip(sense_ids, range(len(sense_ids))))
+
+	key_senses = {}
+	for i, sense_id in enumerate(sense_ids):
+		key_senses.setdefault(get_key(sense_id, use_pos=use_pos), []).append(i)
+	keys = sorted(key_senses)
+	key_ids = [0]*len(sense_ids)
+	offsets = [0]
+	grouped = []
+	for k, key in enumerate(keys):
+		for i in key_senses[key]: key_ids[i] = k
+		grouped.extend(key_senses[key])
+		offsets.append(len(grouped))
+
+	quote_support = [0]*len(sense_ids)
+	for q in quotations:
+		if q[1] in ids: quote_support[ids[q[1]]] += 1
+	ex_support = [0]*len(sense_ids)
+	for e in examples:
+		if e[1] in ids: ex_support[ids[e[1]]] += 1
+
+	by_hash, bucket_start = _hash_buckets(sense_ids)
+	columns = {'sense_id': sense_ids,
+		'key_id': key_ids,
+		'key': keys,
+		'key_offsets': offsets,
+		'key_senses': grouped,
+		'quotation_support': quote_support,
+		'example_support': ex_support,
+		'use_pos': [int(use_pos)],
+		'source': list(source or []),
+		'by_hash': by_hash,
+		'bucket_start': bucket_start}
+	index = SenseIndex(columns)
+	index._ids = ids
+	return index
+
+#save a sense index to a binary file
+def save_sense_index(filepath, index):
+	columns = {name: list(values) for name, values in index.columns.items()}
+	save_binary(filepath, 'sinv', columns)
+	return
+
+#load a sense index from a binary file (mapped, so loading is almost free)
+def load_sense_index(filepath):
+	_, columns = load_binary(filepath)
+	return SenseIndex(columns)
+
+#a batch of eval examples with the candidate senses of their keys: examples (indices into the
+#examples given to candidate_batches), senses (integer ids in the sense index of the distinct
+#candidates of the batch, so each gloss is encoded once per batch), candidates (len(examples)
+#rows of num_candidates indices into senses, padded with -1) and labels (the position of each
+#example's label in its row of candidates, or -1 if the label is not in the sense index)
+CandidateBatch = collections.namedtuple('CandidateBatch', ['examples', 'senses', 'candidates', 'num_candidates', 'labels'])
+
+#groups eval examples (rows, or their labels) by the key of their label into batches of up to
+#batch_size examples, and up to max_senses distinct candidate senses if given, so that examples
+#sharing a key share a batch and its candidates. the arrays of each batch are int32 array.arrays,
+#which numpy and torch can wrap without copying, e.g.
+#np.frombuffer(batch.candidates, dtype=np.int32).reshape(-1, batch.num_candidates).
+#senses are in senses.txt order, so they also index the glosses of a senses.txt token cache
+def candidate_batches(examples, sense_index, batch_size=32, max_senses=None):
+	#examples (index and sense id) of each key, in order of first appearance
+	groups = {}
+	for i, ex in enumerate(examples):
+		label = ex if isinstance(ex, str) else ex[1]
+		j = sense_index.ids.get(label)
+		if j is not None: k = sense_index.key_ids[j]
+		else: k = sense_index.key_id(get_key(label, use_pos=sense_index.use_pos))
+		groups.setdefault(k, []).append((i, j))
+
+	batches = []
+	batch = []
+	batch_senses = {}
+	def flush():
+		num_candidates = max(len(row) for _, row, _ in batch)
+		candidates = array.array('i')
+		labels = array.array('i')
+		for _, row, label in batch:
+			candidates.extend(batch_senses[s] for s in row)
+			candidates.extend([-1]*(num_candidates-len(row)))
+			labels.append(label)
+		batches.append(CandidateBatch(array.array('i', (i for i, _, _ in batch)), array.array('i', batch_senses),
+			candidates, num_candidates, labels))
+		batch.clear()
+		batch_senses.clear()
+
+	for k, group in groups.items():
+		if k < 0: row = []
+		else: row = list(sense_index.key_senses[sense_index.key_offsets[k]:sense_index.key_offsets[k+1]])
+		if len(batch) > 0 and max_senses is not None and len(batch_senses)+len(row) > max_senses: flush()
+		for i, j in group:
+			if len(batch) == batch_size: flush()
+			if len(row) > 0 and row[0] not in batch_senses:
+				for s in row: batch_senses[s] = len(batch_senses)
+			label = row.index(j) if j is not None else -1
+			batch.append((i, row, label))
+	if len(batch) > 0: flush()
+	return batches
+
+#an N-way K-shot episode: the labels of its ways, and the indices of the support (k_shot per way)
+#and query (n_query per way) examples of each way, way by way (way w's support examples are
+#support[w*k_shot:(w+1)*k_shot])
+Episode = collections.namedtuple('Episode', ['labels', 'support', 'query'])
+
+#samples N-way K-shot episodes from examples (rows, or their labels). indexes of the examples
+#of each label and the labels of each key (see get_key) are built once, as offsets into flat
+#arrays, so drawing an episode costs O(N*K). the ways are n_way labels with at least
+#k_shot+n_query examples, drawn from all such labels or, with siblings, from the senses of one
+#key (as in FEWS's polysemous eval sets). episode i only depends on seed and i, and a dataloader
+#worker iterates over every num_workers-th episode from worker on, so the episodes are the
+#same for any number of workers
+class EpisodeSampler:
+	def __init__(self, examples, n_way, k_shot, n_query=1, siblings=False, use_pos=True,
+		num_episodes=None, seed=0, worker=0, num_workers=1):
+		self.n_way = n_way
+		self.k_shot = k_shot
+		self.n_query = n_query
+		self.siblings = siblings
+		self.num_episodes = num_episodes
+		self.seed = seed
+		self.worker = worker
+		self.num_workers = num_workers
+
+		#examples of each label: label_examples[label_offsets[l]:label_offsets[l+1]]
+		label_ids = {}
+		example_labels = array.array('i')
+		for ex in examples:
+			label = ex if isinstance(ex, str) else ex[1]
+			if label not in label_ids: label_ids[label] = len(label_ids)
+			example_labels.append(label_ids[label])
+		self.labels = list(label_ids)
+		counts = [0]*len(self.labels)
+		for l in example_labels: counts[l] += 1
+		self.label_offsets = array.array('q', [0])
+		for c in counts: self.label_offsets.append(self.label_offsets[-1]+c)
+		self.label_examples = array.array('i', bytes(4*len(example_labels)))
+		fill = array.array('q', self.label_offsets[:-1])
+		for i, l in enumerate(example_labels):
+			self.label_examples[fill[l]] = i
+			fill[l] += 1
+
+		#labels with enough examples for an episode, and (for siblings) the keys with at least
+		#n_way of them: key_labels[key_offsets[k]:key_offsets[k+1]]
+		shots = k_shot+n_query
+		self.eligible = array.array('i', (l for l in range(len(self.labels)) if counts[l] >= shots))
+		key_labels = {}
+		for l in self.eligible:
+			key_labels.setdefault(get_key(self.labels[l], use_pos=use_pos), []).append(l)
+		self.keys = [key for key, labels in key_labels.items() if len(labels) >= n_way]
+		self.key_offsets = array.array('q', [0])
+		self.key_labels = array.array('i')
+		for key in self.keys:
+			self.key_labels.extend(key_labels[key])
+			self.key_offsets.append(len(self.key_labels))
+
+		if siblings and len(self.keys) == 0:
+			raise ValueError('no key has {} senses with {} examples'.format(n_way, shots))
+		if not siblings and len(self.eligible) < n_way:
+			raise ValueError('only {} labels have {} examples, fewer than {} ways'.format(len(self.eligible), shots, n_way))
+
+	#draws the i-th episode
+	def episode(self, i):
+		rng = random.Random('{}-{}'.format(self.seed, i))
+		if self.siblings:
+			k = rng.randrange(len(self.keys))
+			start = self.key_offsets[k]
+			ways = rng.sample(range(self.key_offsets[k+1]-start), self.n_way)
+			ways = [self.key_labels[start+w] for w in ways]
+		else:
+			ways = [self.eligible[w] for w in rng.sample(range(len(self.eligible)), self.n_way)]
+
+		support = array.array('i')
+		query = array.array('i')
+		for l in ways:
+			start = self.label_offsets[l]
+			shots = rng.sample(range(self.label_offsets[l+1]-start), self.k_shot+self.n_query)
+			support.extend(self.label_examples[start+j] for j in shots[:self.k_shot])
+			query.extend(self.label_examples[start+j] for j in shots[self.k_shot:])
+		return Episode([self.labels[l] for l in ways], support, query)
+
+	def __len__(self):
+		if self.num_episodes is None: raise TypeError('an endless episode sampler has no length')
+		return len(range(self.worker, self.num_episodes, self.num_workers))
+
+	#yields this worker's episodes (endlessly if num_episodes is None)
+	def __iter__(self):
+		i = self.worker
+		while self.num_episodes is None or i < self.num_episodes:
+			yield self.episode(i)
+			i += self.num_workers
+
 #EOF
\ No newline at end of file